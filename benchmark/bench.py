@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import time
+import bisect
+import heapq
+import shutil
+import socket
+import tempfile
+import subprocess
+from datetime import datetime
+from ConfigParser import ConfigParser
+
+DIR = os.path.dirname(os.path.abspath(__file__))
+TOPDIR = os.path.dirname(DIR)
+sys.path.insert(0, TOPDIR)
+
+from runlocal import read_dax
+from telemetry import read_workflow, summarize
+from synthmg import generate
+from stagegraph import StageGraph
+
+DAXGEN = os.path.join(TOPDIR, "daxgen.py")
+RUNLOCAL = os.path.join(TOPDIR, "runlocal.sh")
+STUB_PIPELINE_DIR = os.path.join(DIR, "pipeline")
+
+DAXGEN_SAMPLES = [1, 10, 100, 1000, 10000]
+DAG_CORES = [24, 96, 384]
+GRAPH_SAMPLES = [1, 10, 100, 1000, 10000]
+
+# The graph benchmark clusters the jobs of at most this many minutes, the
+# default cluster_walltime
+GRAPH_CLUSTER_WALLTIME = 30
+
+# Every sample of the daxgen benchmark is the same small metagenome, so the
+# benchmark measures daxgen and not the input scan
+READS_PER_SAMPLE = 1000
+
+# compare reports a regression when a result is this much slower than before
+REGRESSION_THRESHOLD = 0.1
+
+# The metric compared for each benchmark, and the field that identifies a result
+METRICS = {
+	"daxgen": ("samples", "seconds"),
+	"dag": ("cores", "makespan"),
+	"graph": ("samples", "seconds"),
+	"run": ("cores", "makespan")
+}
+
+
+def write_results(path, benchmark, results, **extra):
+	"Write 'results' of 'benchmark' to 'path' as JSON, with the host and time they were taken on"
+	doc = {
+		"benchmark": benchmark,
+		"date": datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+		"host": socket.gethostname(),
+		"python": sys.version.split()[0],
+		"results": results
+	}
+	doc.update(extra)
+	f = open(path, "w")
+	try:
+		json.dump(doc, f, indent=2, sort_keys=True)
+	finally:
+		f.close()
+
+def read_json(path):
+	f = open(path, "r")
+	try:
+		return json.load(f)
+	finally:
+		f.close()
+
+def timed(args, **kwargs):
+	"Run 'args' and return its wall seconds and peak RSS in KB. Raises if it fails"
+	start = time.time()
+	proc = subprocess.Popen(args, **kwargs)
+	pid, status, usage = os.wait4(proc.pid, 0)
+	proc.returncode = status
+	if status != 0:
+		raise Exception("Failed: %s" % " ".join(args))
+	return time.time() - start, usage.ru_maxrss
+
+
+def bench_daxgen(configfile, counts):
+	"Time daxgen.py on batches of 'counts' samples"
+	config = ConfigParser()
+	config.read(configfile)
+	file_format = config.get("simulation", "file_format")
+
+	tmpdir = tempfile.mkdtemp()
+	try:
+		mgfile = os.path.join(tmpdir, "sample.%s" % file_format)
+		f = open(mgfile, "w")
+		try:
+			generate(f, file_format, reads=READS_PER_SAMPLE)
+		finally:
+			f.close()
+
+		results = []
+		devnull = open(os.devnull, "w")
+		try:
+			for n in counts:
+				manifest = os.path.join(tmpdir, "samples%d.txt" % n)
+				f = open(manifest, "w")
+				try:
+					for i in range(n):
+						f.write("sample%05d %s\n" % (i, mgfile))
+				finally:
+					f.close()
+
+				outdir = os.path.join(tmpdir, "run%d" % n)
+				seconds, maxrss = timed([sys.executable, DAXGEN, "--manifest", manifest, configfile, outdir], stdout=devnull)
+				daxfile = os.path.join(outdir, "dax.xml")
+				jobs = len(read_json(os.path.join(outdir, "jobs.json")))
+				results.append({"samples": n, "jobs": jobs, "seconds": seconds, "seconds_per_sample": seconds / n,
+					"maxrss": maxrss, "dax_size": os.path.getsize(daxfile)})
+				print("%6d samples %7d jobs %9.2f s %8.1f MB" % (n, jobs, seconds, maxrss / 1024.0))
+				shutil.rmtree(outdir)
+		finally:
+			devnull.close()
+	finally:
+		shutil.rmtree(tmpdir)
+	return results
+
+
+def count_samples(requested):
+	"Return the number of samples in a workflow from its jobs.json. Every sample has exactly one protein annotate-sims job, which is never cached"
+	return len([job for job in requested.values() if job["stage"] == "wrapper-annotate-sims-aa"])
+
+def children(jobs):
+	"Return the IDs of the children of every job in 'jobs', keyed by job ID"
+	result = dict((jid, []) for jid in jobs)
+	for jid, job in jobs.items():
+		for parent in job.parents:
+			result[parent].append(jid)
+	return result
+
+def simulate(jobs, runtimes, cores):
+	"Return the makespan in minutes and the core utilization of running 'jobs' on 'cores' cores, with the policy of runlocal.py: the ready jobs with the highest priority start first, each on the cores of its count, while cores are free"
+	kids = children(jobs)
+	waiting = dict((jid, len(job.parents)) for jid, job in jobs.items())
+	order = lambda jid: (-jobs[jid].priority, jid)
+	ready = sorted(order(jid) for jid in jobs if waiting[jid] == 0)
+	running = []
+	free = cores
+	now = busy = 0.0
+	finished = 0
+	while ready or running:
+		started = []
+		for i, (priority, jid) in enumerate(ready):
+			if free == 0:
+				break
+			count = min(jobs[jid].count, cores)
+			if count <= free:
+				heapq.heappush(running, (now + runtimes[jid], jid, count))
+				free -= count
+				busy += runtimes[jid] * count
+				started.append(i)
+		for i in reversed(started):
+			del ready[i]
+
+		now, jid, count = heapq.heappop(running)
+		free += count
+		finished += 1
+		for child in kids[jid]:
+			waiting[child] -= 1
+			if waiting[child] == 0:
+				bisect.insort(ready, order(child))
+	if finished != len(jobs):
+		raise Exception("The workflow has a dependency cycle")
+	return now, busy / (cores * now) if now else 0.0
+
+def critical_path(jobs, runtimes):
+	"Return the length in minutes of the longest path through 'jobs'"
+	kids = children(jobs)
+	waiting = dict((jid, len(job.parents)) for jid, job in jobs.items())
+	order = [jid for jid in jobs if waiting[jid] == 0]
+	for jid in order:
+		for child in kids[jid]:
+			waiting[child] -= 1
+			if waiting[child] == 0:
+				order.append(child)
+	finish = {}
+	for jid in order:
+		finish[jid] = runtimes[jid] + max([finish[p] for p in jobs[jid].parents] or [0])
+	return max(finish.values() or [0])
+
+def bench_dag(wfdir, cores):
+	"Simulate the workflow in 'wfdir' on each of 'cores'. Jobs run for their requested walltime, or for the wall time measured by telemetry.py where the workflow has been run"
+	jobs = read_dax(os.path.join(wfdir, "dax.xml"))
+	requested = read_json(os.path.join(wfdir, "jobs.json"))
+	runtimes = dict((jid, float(requested[jid]["walltime"])) for jid in jobs)
+	measured = 0
+	for record in read_workflow(wfdir):
+		if record["status"] == 0 and record["job"] in runtimes:
+			runtimes[record["job"]] = record["walltime"] / 60.0
+			measured += 1
+
+	samples = count_samples(requested)
+	path = critical_path(jobs, runtimes)
+	work = sum(runtimes[jid] * jobs[jid].count for jid in jobs)
+
+	results = []
+	for n in cores:
+		makespan, utilization = simulate(jobs, runtimes, n)
+		results.append({"cores": n, "makespan": makespan, "throughput": samples * 60.0 / makespan if makespan else 0.0,
+			"utilization": utilization})
+		print("%6d cores %10.1f min %8.2f samples/h %5.0f%% busy" % (n, makespan, results[-1]["throughput"], 100 * utilization))
+	print("Critical path %.1f min, %.1f core hours of work, %d of %d runtimes measured" % (path, work / 60.0, measured, len(jobs)))
+	return results, {"workflow": os.path.abspath(wfdir), "jobs": len(jobs), "samples": samples,
+		"critical_path": path, "work": work, "measured_runtimes": measured}
+
+
+class GraphJob(object):
+	"A job of the graph benchmark"
+
+	def __init__(self, jid):
+		self.id = jid
+
+
+def sample_graph(jobs, walltimes, n):
+	"Return a StageGraph of 'n' copies of the workflow 'jobs', joined by one job that depends on all of them, as the merge of a batch does, and the short jobs of the graph. Every job also depends on the parents of its parents, as daxgen.py adds dependencies that the reduction removes"
+	graph = StageGraph()
+	ids = sorted(jobs)
+	join = GraphJob("join")
+	graph.add_job(join, GRAPH_CLUSTER_WALLTIME)
+	short = [join]
+	for i in range(n):
+		copies = dict((jid, GraphJob("%s.%d" % (jid, i))) for jid in ids)
+		for jid in ids:
+			graph.add_job(copies[jid], walltimes[jid])
+			if walltimes[jid] <= GRAPH_CLUSTER_WALLTIME:
+				short.append(copies[jid])
+		for jid in ids:
+			for parent in jobs[jid].parents:
+				graph.add_edge(copies[parent], copies[jid])
+				for grandparent in jobs[parent].parents:
+					graph.add_edge(copies[grandparent], copies[jid])
+			if not any(jid in jobs[other].parents for other in ids):
+				graph.add_edge(copies[jid], join)
+	return graph, short
+
+def bench_graph(wfdir, counts):
+	"Time the transitive reduction and the label clustering of the stage graph on batches of 'counts' copies of the workflow in 'wfdir'"
+	jobs = read_dax(os.path.join(wfdir, "dax.xml"))
+	requested = read_json(os.path.join(wfdir, "jobs.json"))
+	walltimes = dict((jid, requested[jid]["walltime"]) for jid in jobs)
+
+	results = []
+	for n in counts:
+		graph, short = sample_graph(jobs, walltimes, n)
+		start = time.time()
+		edges = graph.reduced_edges()
+		reduction = time.time() - start
+		start = time.time()
+		groups = graph.convex_groups(short)
+		grouping = time.time() - start
+		results.append({"samples": n, "jobs": len(graph.nodes), "edges": len(graph.edges()), "reduced_edges": len(edges),
+			"groups": len(groups), "reduction_seconds": reduction, "grouping_seconds": grouping, "seconds": reduction + grouping})
+		print("%6d samples %8d jobs %8d edges %9.2f s reduction %9.2f s grouping" % (n, len(graph.nodes), len(edges), reduction, grouping))
+	return results, {"workflow": os.path.abspath(wfdir)}
+
+
+def bench_run(wfdir, cores):
+	"Run the workflow in 'wfdir' with runlocal.sh and the stub pipeline, and return its makespan in minutes and the telemetry of its stages"
+	if os.path.exists(os.path.join(wfdir, "work")):
+		raise Exception("The workflow has already been run: %s" % wfdir)
+	env = dict(os.environ)
+	env["PIPELINE_DIR"] = STUB_PIPELINE_DIR
+	env["CORES"] = str(cores)
+	seconds, maxrss = timed([RUNLOCAL, wfdir], env=env)
+
+	requested = read_json(os.path.join(wfdir, "jobs.json"))
+	samples = count_samples(requested)
+	stages = summarize(read_workflow(wfdir))
+	result = {"cores": cores, "makespan": seconds / 60.0, "throughput": samples * 3600.0 / seconds, "stages": stages}
+	print("%6d cores %10.2f min %8.2f samples/h" % (cores, result["makespan"], result["throughput"]))
+	return [result], {"workflow": os.path.abspath(wfdir), "samples": samples}
+
+
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+	"Print the change of the metric of every result in 'new' that is also in 'old'. Returns the number of regressions"
+	if old["benchmark"] != new["benchmark"]:
+		raise Exception("Cannot compare %s results with %s results" % (old["benchmark"], new["benchmark"]))
+	key, metric = METRICS[new["benchmark"]]
+	before = dict((r[key], r[metric]) for r in old["results"])
+	regressions = 0
+	for r in new["results"]:
+		if r[key] not in before:
+			continue
+		change = (r[metric] - before[r[key]]) / before[r[key]] if before[r[key]] else 0.0
+		flag = ""
+		if change > threshold:
+			flag = "  REGRESSION"
+			regressions += 1
+		print("%s %6d: %s %10.2f -> %10.2f (%+.1f%%)%s" % (key, r[key], metric, before[r[key]], r[metric], 100 * change, flag))
+	return regressions
+
+
+def main():
+	usage = "Usage: %s daxgen RESULTS CONFIGFILE [SAMPLES...] | dag RESULTS WORKFLOW_DIR [CORES...] | graph RESULTS WORKFLOW_DIR [SAMPLES...] | run RESULTS WORKFLOW_DIR CORES | compare OLD NEW" % sys.argv[0]
+	if len(sys.argv) >= 4 and sys.argv[1] == "daxgen":
+		counts = [int(n) for n in sys.argv[4:]] or DAXGEN_SAMPLES
+		write_results(sys.argv[2], "daxgen", bench_daxgen(os.path.abspath(sys.argv[3]), counts))
+	elif len(sys.argv) >= 4 and sys.argv[1] == "dag":
+		cores = [int(n) for n in sys.argv[4:]] or DAG_CORES
+		results, extra = bench_dag(sys.argv[3], cores)
+		write_results(sys.argv[2], "dag", results, **extra)
+	elif len(sys.argv) >= 4 and sys.argv[1] == "graph":
+		counts = [int(n) for n in sys.argv[4:]] or GRAPH_SAMPLES
+		results, extra = bench_graph(sys.argv[3], counts)
+		write_results(sys.argv[2], "graph", results, **extra)
+	elif len(sys.argv) == 5 and sys.argv[1] == "run":
+		results, extra = bench_run(os.path.abspath(sys.argv[3]), int(sys.argv[4]))
+		write_results(sys.argv[2], "run", results, **extra)
+	elif len(sys.argv) == 4 and sys.argv[1] == "compare":
+		if compare(read_json(sys.argv[2]), read_json(sys.argv[3])):
+			sys.exit(1)
+	else:
+		raise Exception(usage)
+
+
+if __name__ == '__main__':
+	main()
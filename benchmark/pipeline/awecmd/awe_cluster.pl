@@ -0,0 +1 @@
+../../stubstage.py
\ No newline at end of file
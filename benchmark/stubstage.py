@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import multiprocessing
+
+# The stub takes the place of the awe_* command it is named after. It reads its
+# inputs, burns CPU in proportion to their size, and writes outputs with the
+# names the real command would use, sized in proportion to the inputs. Under any
+# other name (cdbfasta, bowtie2, ...) it does nothing and succeeds, so that the
+# wrappers find every tool they check for.
+#
+# STUB_CPU_SCALE multiplies every CPU cost (default 1), and STUB_COSTS names a
+# JSON file of {"awe_qc.pl": {"cpu": SECONDS_PER_MB, "output": FACTOR}} that
+# replaces the default CPU cost of a command and scales its output sizes.
+
+MB = 1024.0 * 1024.0
+
+BLOCK_SIZE = 1 << 20
+
+# CPU seconds per MB of input, roughly in proportion to the default walltimes of
+# the stages in daxgen.py
+CPU_COSTS = {
+	"awe_qc.pl": 0.2,
+	"awe_preprocess.pl": 0.05,
+	"awe_dereplicate.pl": 0.05,
+	"awe_bowtie_screen.pl": 0.2,
+	"awe_genecalling.pl": 0.3,
+	"awe_cluster.pl": 0.1,
+	"awe_blat_prot.py": 2.0,
+	"awe_annotate_sims.pl": 0.5,
+	"awe_search_rna.pl": 0.5,
+	"awe_blat_rna.pl": 0.2,
+	"awe_index_sim_seq.pl": 0.2,
+	"awe_annotate_summary.pl": 0.1
+}
+
+
+def parse_options(args):
+	"Return the options in 'args' as a dict of lists of values. Options are written -name value, -name=value or --name=value, and options without a value are flags"
+	options = {}
+	i = 0
+	while i < len(args):
+		arg = args[i]
+		i += 1
+		if not arg.startswith("-"):
+			continue
+		name = arg.lstrip("-")
+		if "=" in name:
+			name, value = name.split("=", 1)
+		elif i < len(args) and not args[i].startswith("-"):
+			value = args[i]
+			i += 1
+		else:
+			value = True
+		options.setdefault(name, []).append(value)
+	return options
+
+def outputs(command, options):
+	"Return the (path, fraction of the input size) of every file 'command' writes for 'options'"
+	def opt(name):
+		if name not in options:
+			raise Exception("%s: -%s is required" % (command, name))
+		return options[name][0]
+	kind = "aa" if "aa" in options else "rna"
+
+	if command == "awe_qc.pl":
+		prefix = opt("out_prefix")
+		return [(prefix + ".assembly.coverage", 0.01), (prefix + ".qc.stats", 0.001), (prefix + ".upload.stats", 0.001)]
+	elif command == "awe_preprocess.pl":
+		prefix = opt("out_prefix")
+		return [(prefix + ".passed.fna", 0.9), (prefix + ".removed.fna", 0.1)]
+	elif command == "awe_dereplicate.pl":
+		prefix = opt("out_prefix")
+		return [(prefix + ".passed.fna", 0.85), (prefix + ".removed.fna", 0.05)]
+	elif command == "awe_genecalling.pl":
+		prefix = opt("out_prefix")
+		return [(prefix + ".faa", 0.4), (prefix + ".fna", 0.8)]
+	elif command == "awe_cluster.pl":
+		prefix = "%s.%s%s" % (opt("out_prefix"), kind, opt("pid"))
+		return [(prefix + (".faa" if kind == "aa" else ".fna"), 0.8), (prefix + ".mapping", 0.1)]
+	elif command == "awe_annotate_sims.pl":
+		prefix = "%s.%s" % (opt("out_prefix"), kind)
+		files = [(prefix + ".sims.filter", 0.5), (prefix + ".expand.lca", 0.3)]
+		if kind == "aa":
+			files += [(prefix + ".expand.protein", 1.0), (prefix + ".expand.ontology", 1.0)]
+		else:
+			files += [(prefix + ".expand.rna", 1.0)]
+		return files
+	elif command == "awe_index_sim_seq.pl":
+		output = opt("output")
+		return [(output, 0.5), (output + ".index", 0.05)]
+	elif command in ("awe_bowtie_screen.pl", "awe_blat_prot.py", "awe_search_rna.pl", "awe_blat_rna.pl", "awe_annotate_summary.pl"):
+		ratio = {"awe_bowtie_screen.pl": 0.95, "awe_blat_prot.py": 2.0, "awe_search_rna.pl": 0.05,
+			"awe_blat_rna.pl": 0.5, "awe_annotate_summary.pl": 0.1}[command]
+		return [(opt("output"), ratio)]
+	raise Exception("Unknown command: %s" % command)
+
+def inputs(options):
+	"Return the input files named by 'options': the values of -input and of the -in_* options"
+	files = []
+	for name, values in sorted(options.items()):
+		if name == "input" or name.startswith("in_"):
+			files += [v for v in values if v is not True]
+	return files
+
+
+def burn(seconds):
+	"Use 'seconds' of CPU time"
+	end = os.times()[0] + seconds
+	x = 0
+	while os.times()[0] < end:
+		for i in range(10000):
+			x += i * i
+	return x
+
+def write_output(path, size, sample):
+	"Write 'size' bytes to 'path' by repeating 'sample'"
+	if not sample:
+		sample = "N" * BLOCK_SIZE
+	f = open(path, "w")
+	try:
+		while size > 0:
+			block = sample[:size]
+			f.write(block)
+			size -= len(block)
+	finally:
+		f.close()
+
+def run(command, args):
+	options = parse_options(args)
+	costs = {}
+	if os.environ.get("STUB_COSTS"):
+		f = open(os.environ["STUB_COSTS"], "r")
+		try:
+			costs = json.load(f).get(command, {})
+		finally:
+			f.close()
+
+	# Read every input, keeping the first block as the contents of the outputs
+	size = 0
+	sample = ""
+	for path in inputs(options):
+		f = open(path, "r")
+		try:
+			while True:
+				block = f.read(BLOCK_SIZE)
+				if not block:
+					break
+				if not sample:
+					sample = block
+				size += len(block)
+		finally:
+			f.close()
+
+	# The CPU time is shared by as many processes as the command would use threads
+	seconds = costs.get("cpu", CPU_COSTS[command]) * size / MB * float(os.environ.get("STUB_CPU_SCALE", 1))
+	procs = int((options.get("proc") or [os.environ.get("OMP_NUM_THREADS") or 1])[0])
+	if procs > 1 and seconds > 0:
+		pool = multiprocessing.Pool(procs)
+		pool.map(burn, [seconds / procs] * procs)
+		pool.close()
+		pool.join()
+	else:
+		burn(seconds)
+
+	factor = costs.get("output", 1.0)
+	for path, ratio in outputs(command, options):
+		write_output(path, int(size * ratio * factor), sample)
+
+
+def main():
+	command = os.path.basename(sys.argv[0])
+	if command in CPU_COSTS:
+		run(command, sys.argv[1:])
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+import gzip
+import random
+from optparse import OptionParser
+
+# Reads are cut from a pool of random bases instead of drawing every base, so that
+# gigabyte-sized metagenomes take seconds rather than hours
+POOL_SIZE = 1 << 20
+
+# Fraction of the bases that are G or C, and of the reads that contain an N
+GC_CONTENT = 0.45
+AMBIGUOUS_READS = 0.01
+
+UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+
+def parse_size(text):
+	"Return the number of bytes in 'text', a number with an optional K, M or G suffix"
+	text = text.strip().upper()
+	unit = text[-1:] if text[-1:] in UNITS else ""
+	return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+def base_pool(rng, size=POOL_SIZE):
+	at = (1.0 - GC_CONTENT) / 2
+	bases = []
+	for i in range(size):
+		x = rng.random()
+		if x < at:
+			bases.append("A")
+		elif x < 2 * at:
+			bases.append("T")
+		elif x < 2 * at + GC_CONTENT / 2:
+			bases.append("G")
+		else:
+			bases.append("C")
+	return "".join(bases)
+
+def quality_pool(rng, size=POOL_SIZE):
+	return "".join(chr(33 + min(41, max(2, int(rng.gauss(32, 6))))) for i in range(size))
+
+def generate(out, file_format="fasta", size=None, reads=None, length=150, seed=0):
+	"Write random reads to the file object 'out' until 'size' bytes or 'reads' reads are written. Read lengths are normally distributed around 'length'. Returns the number of reads and bytes written"
+	if size is None and reads is None:
+		raise Exception("Either size or reads is required")
+	rng = random.Random(seed)
+	bases = base_pool(rng)
+	quals = quality_pool(rng) if file_format == "fastq" else None
+
+	n = written = 0
+	while (size is None or written < size) and (reads is None or n < reads):
+		l = max(20, min(POOL_SIZE - 1, int(rng.gauss(length, length / 5.0))))
+		i = rng.randrange(POOL_SIZE - l)
+		seq = bases[i:i + l]
+		if rng.random() < AMBIGUOUS_READS:
+			j = rng.randrange(l)
+			seq = seq[:j] + "N" + seq[j + 1:]
+		n += 1
+		if file_format == "fastq":
+			record = "@read_%d\n%s\n+\n%s\n" % (n, seq, quals[i:i + l])
+		else:
+			record = ">read_%d\n%s\n" % (n, seq)
+		out.write(record)
+		written += len(record)
+	return n, written
+
+
+def main():
+	parser = OptionParser(usage="%prog [options] OUTPUT",
+		description="Write a synthetic metagenome of random reads. OUTPUT is gzip-compressed if it ends with .gz.")
+	parser.add_option("-f", "--format", dest="format", default="fasta", choices=["fasta", "fastq"],
+		help="fasta or fastq (default: fasta)")
+	parser.add_option("-s", "--size", dest="size", default=None,
+		help="Uncompressed size to write, e.g. 500M or 2G")
+	parser.add_option("-n", "--reads", dest="reads", type="int", default=None,
+		help="Number of reads to write")
+	parser.add_option("-l", "--length", dest="length", type="int", default=150,
+		help="Mean read length (default: 150)")
+	parser.add_option("--seed", dest="seed", type="int", default=0,
+		help="Random seed (default: 0)")
+	options, args = parser.parse_args()
+
+	if len(args) != 1:
+		parser.error("OUTPUT is required")
+	if options.size is None and options.reads is None:
+		parser.error("--size or --reads is required")
+
+	path = args[0]
+	if path.endswith(".gz"):
+		out = gzip.open(path, "wb")
+	else:
+		out = open(path, "w")
+	try:
+		size = options.size and parse_size(options.size)
+		n, written = generate(out, options.format, size, options.reads, options.length, options.seed)
+	finally:
+		out.close()
+	print("%s: %d reads, %d bytes" % (path, n, written))
+
+
+if __name__ == '__main__':
+	main()
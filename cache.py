@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+import sys
+import os
+import time
+import json
+import fcntl
+import shutil
+import hashlib
+
+# Files are read in blocks of this many bytes while they are hashed or copied
+BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+	"Return the SHA-1 hex digest of the contents of 'path'"
+	h = hashlib.sha1()
+	f = open(path, "rb")
+	try:
+		while True:
+			block = f.read(BLOCK_SIZE)
+			if not block:
+				break
+			h.update(block)
+	finally:
+		f.close()
+	return h.hexdigest()
+
+def stage_key(stage, version, arguments, parents):
+	"Return the cache key of a stage: a digest of its name, the pipeline version, the arguments that change its outputs, and the keys (or input file digests) of the stages it reads from"
+	data = json.dumps([stage, version, [str(a) for a in arguments], list(parents)])
+	return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+class StageCache(object):
+	"A directory of stage outputs keyed by stage_key(), with one subdirectory per entry. index.json records the files, size and last use of every entry; the least recently used entries are evicted when the cache grows beyond max_size bytes. Entries that were looked up are leased for 'lease' seconds and not evicted before the lease runs out, so that the workflow they were registered for can still stage them"
+
+	def __init__(self, path, max_size, lease=0):
+		self.path = path
+		self.max_size = max_size
+		self.lease = lease
+		self.indexfile = os.path.join(path, "index.json")
+		self.lockfile = os.path.join(path, "index.lock")
+
+	def lock(self):
+		"Lock the index against other processes. Returns the lock, which is released by closing it"
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+		lock = open(self.lockfile, "a")
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		return lock
+
+	def read_index(self):
+		if not os.path.isfile(self.indexfile):
+			return {}
+		f = open(self.indexfile, "r")
+		try:
+			return json.load(f)
+		finally:
+			f.close()
+
+	def write_index(self, index):
+		tmp = "%s.%d" % (self.indexfile, os.getpid())
+		f = open(tmp, "w")
+		try:
+			json.dump(index, f, indent=2, sort_keys=True)
+		finally:
+			f.close()
+		os.rename(tmp, self.indexfile)
+
+	def lookup(self, key):
+		"Return a dict mapping the file names of the entry 'key' to their paths, or None if the entry is not in the cache. The entry is marked as used and leased"
+		if not os.path.isfile(self.indexfile):
+			return None
+		lock = self.lock()
+		try:
+			index = self.read_index()
+			entry = index.get(key)
+			if entry is None:
+				return None
+			files = dict((name, os.path.join(self.path, key, name)) for name in entry["files"])
+			for path in files.values():
+				if not os.path.isfile(path):
+					return None
+			entry["used"] = time.time()
+			entry["leased"] = max(entry.get("leased", 0), entry["used"] + self.lease)
+			self.write_index(index)
+			return files
+		finally:
+			lock.close()
+
+	def store(self, key, files):
+		"Copy 'files', a dict mapping file names to paths, into the cache as the entry 'key'"
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+
+		# Copy outside the lock, so that concurrent stores only wait for each other's index updates
+		tmp = os.path.join(self.path, "%s.tmp.%d" % (key, os.getpid()))
+		os.makedirs(tmp)
+		size = 0
+		for name, path in files.items():
+			shutil.copyfile(path, os.path.join(tmp, name))
+			size += os.path.getsize(path)
+
+		lock = self.lock()
+		try:
+			index = self.read_index()
+			entrydir = os.path.join(self.path, key)
+			if key in index or os.path.exists(entrydir):
+				shutil.rmtree(tmp)
+			else:
+				os.rename(tmp, entrydir)
+				index[key] = {"files": sorted(files.keys()), "size": size, "used": time.time()}
+			self.evict(index)
+			self.write_index(index)
+		finally:
+			lock.close()
+
+	def evict(self, index):
+		"Remove the least recently used entries from 'index' and the cache until it fits in max_size. Leased entries are kept, even if the cache stays larger. Must be called with the lock held"
+		now = time.time()
+		total = sum(entry["size"] for entry in index.values())
+		for key in sorted(index, key=lambda k: index[k]["used"]):
+			if total <= self.max_size:
+				break
+			if index[key].get("leased", 0) > now:
+				continue
+			total -= index[key]["size"]
+			del index[key]
+			shutil.rmtree(os.path.join(self.path, key), ignore_errors=True)
+
+
+def main():
+	if len(sys.argv) < 5 or sys.argv[1] != "store":
+		raise Exception("Usage: %s store CACHE_DIR MAX_BYTES KEY NAME=FILE..." % sys.argv[0])
+
+	cache = StageCache(sys.argv[2], int(sys.argv[3]))
+	key = sys.argv[4]
+	files = {}
+	for arg in sys.argv[5:]:
+		name, path = arg.split("=", 1)
+		if not os.path.isfile(path):
+			raise Exception("No such file: %s" % path)
+		files[name] = path
+	cache.store(key, files)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,172 @@
+# Sourced by the wrappers. The workflow keeps the files listed in
+# COMPRESSED_INPUTS and COMPRESSED_OUTPUTS compressed with COMPRESSION
+# (gzip or zstd), while the pipeline commands write them under their plain
+# names. Several jobs can read the same file at the same time, so every job
+# reads its own decompressed copy of an input, and the arguments naming the
+# input (NAME or -option=NAME) are changed to name the copy.
+#
+#   compression_start fifo|file ARGUMENTS...
+#   set -- "${compression_args[@]}"
+#   COMMAND
+#   compression_finish STATUS
+#
+# In fifo mode the plain names are FIFOs and the files are (de)compressed
+# while the command runs. This only works when the command runs on this
+# node, and reads its inputs and writes its outputs strictly sequentially:
+# a command that checks the size of a file, seeks in it or opens it twice
+# sees an empty or truncated file. Only the commands of wrapper-merge (cat)
+# and wrapper-split-fasta (awk) are known to do so. The awe_* commands check
+# the size of their inputs and reread some of them, so their wrappers use
+# file mode, which decompresses the inputs before the command and compresses
+# the outputs after it.
+#
+# The copies, FIFOs and background (de)compressors are removed on exit, also
+# when the wrapper fails or is killed. An EXIT trap set before
+# compression_start still runs.
+
+compression_mode=
+compression_args=()
+compression_copies=()
+compression_decompressors=()
+compression_compressors=()
+compression_exit_trap=
+
+compression_tools() {
+	case $COMPRESSION in
+		gzip)
+			compression_ext=gz
+			if which pigz >/dev/null 2>&1; then
+				compress="pigz -c -p ${OMP_NUM_THREADS:-4}"
+				decompress="pigz -dc"
+			else
+				compress="gzip -c"
+				decompress="gzip -dc"
+			fi ;;
+		zstd)
+			compression_ext=zst
+			compress="zstd -c -q -T${OMP_NUM_THREADS:-0}"
+			decompress="zstd -dc -q" ;;
+		*)
+			echo "ERROR: Unknown compression: $COMPRESSION"
+			return 1 ;;
+	esac
+}
+
+# Prints the command of an EXIT trap, given the output of trap -p EXIT
+compression_trap_command() {
+	echo "$3"
+}
+
+# Removes everything compression_start left behind, and runs the EXIT trap
+# that was set before it
+compression_cleanup() {
+	for pid in ${compression_decompressors[@]} ${compression_compressors[@]}; do
+		kill $pid 2>/dev/null
+	done
+	for copy in "${compression_copies[@]}"; do
+		rm -f "$copy"
+	done
+	for f in $COMPRESSED_OUTPUTS; do
+		if [ -p "$f" ]; then
+			rm -f "$f"
+		fi
+	done
+	eval "$compression_exit_trap"
+}
+
+compression_start() {
+	compression_mode=$1
+	compression_args=("${@:2}")
+	if [ -z "$COMPRESSION" ]; then
+		return 0
+	fi
+	compression_tools || return 1
+
+	compression_exit_trap=$(eval "compression_trap_command $(trap -p EXIT)")
+	trap compression_cleanup EXIT
+	trap "exit 129" HUP
+	trap "exit 130" INT
+	trap "exit 143" TERM
+
+	for f in $COMPRESSED_INPUTS; do
+		copy=$HOSTNAME.$$.$f
+		compression_copies+=("$copy")
+		for i in ${!compression_args[@]}; do
+			case ${compression_args[$i]} in
+				"$f") compression_args[$i]=$copy ;;
+				*="$f") compression_args[$i]=${compression_args[$i]%=*}=$copy ;;
+			esac
+		done
+
+		rm -f "$copy"
+		if [ "$compression_mode" = fifo ]; then
+			mkfifo "$copy" || return 1
+			$decompress < "$f.$compression_ext" > "$copy" &
+			compression_decompressors+=($!)
+		else
+			$decompress < "$f.$compression_ext" > "$copy" || return 1
+		fi
+	done
+
+	if [ "$compression_mode" = fifo ]; then
+		for f in $COMPRESSED_OUTPUTS; do
+			rm -f "$f"
+			mkfifo "$f" || return 1
+			$compress < "$f" > "$f.$compression_ext" &
+			compression_compressors+=($!)
+		done
+	fi
+}
+
+compression_finish() {
+	status=$1
+	if [ -z "$COMPRESSION" ]; then
+		exit $status
+	fi
+
+	if [ "$compression_mode" = fifo ]; then
+		# Inputs the command did not read leave their decompressors blocked
+		for pid in ${compression_decompressors[@]}; do
+			kill $pid 2>/dev/null
+			wait $pid
+			case $? in
+				0|141|143) ;;
+				*) echo "ERROR: Decompression failed"; status=1 ;;
+			esac
+		done
+
+		# Outputs the command did not write leave their compressors blocked;
+		# opening the FIFO read-write releases them with an empty file. The
+		# compressor of an output that was replaced by a regular file can
+		# never be released and is killed
+		i=0
+		for f in $COMPRESSED_OUTPUTS; do
+			pid=${compression_compressors[$i]}
+			i=$((i + 1))
+			if [ -p "$f" ]; then
+				exec 3<>"$f"
+				exec 3>&-
+				wait $pid || status=1
+			else
+				kill $pid 2>/dev/null
+				wait $pid
+			fi
+		done
+	fi
+
+	# Outputs that were written as regular files, in file mode or by commands
+	# that replace their output file, are compressed now
+	for f in $COMPRESSED_OUTPUTS; do
+		if [ $status -eq 0 ] && [ -f "$f" ] && [ ! -p "$f" ]; then
+			$compress < "$f" > "$f.$compression_ext" || status=1
+		fi
+		rm -f "$f"
+	done
+	for copy in "${compression_copies[@]}"; do
+		rm -f "$copy"
+	done
+	compression_copies=()
+	compression_decompressors=()
+	compression_compressors=()
+	exit $status
+}
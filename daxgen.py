@@ -1,22 +1,134 @@
 #!/usr/bin/env python
-import sys
 import string
 import os
+import re
+import math
+import json
+import itertools
+from optparse import OptionParser
 from datetime import datetime
 from ConfigParser import ConfigParser
 from Pegasus.DAX3 import ADAG, Job, File, Link
+from resources import Resources, ResourceModel
+from cache import StageCache, file_digest, stage_key
+from inputstats import profile
+from refdb import read_manifest as read_refdb_manifest
+from stagegraph import StageGraph
+from subsample import subsample, METHODS as SAMPLING_METHODS
 
 DAXGEN_DIR = os.path.dirname(os.path.realpath(__file__))
 
+# The annotation summaries: type, output, and the expanded protein and RNA
+# annotations they are built from. Ontologies only exist for proteins
+SUMMARIES = [
+	("md5", "700.annotation.md5.summary", "650.aa.expand.protein", "450.rna.expand.rna"),
+	("function", "700.annotation.function.summary", "650.aa.expand.protein", "450.rna.expand.rna"),
+	("organism", "700.annotation.organism.summary", "650.aa.expand.protein", "450.rna.expand.rna"),
+	("lca", "700.annotation.lca.summary", "650.aa.expand.lca", "450.rna.expand.lca"),
+	("ontology", "700.annotation.ontology.summary", "650.aa.expand.ontology", None),
+	("source", "700.annotation.source.stats", "650.aa.expand.protein", "450.rna.expand.rna")
+]
+
+# Stages whose outputs are kept in the stage cache, in pipeline order, with the stages they read
+# from, the settings that change their outputs, and their outputs
+CACHED_STAGES = [
+	("qc", [], ["file_format", "assembled", "filter_options"],
+		["075.assembly.coverage", "075.qc.stats", "075.upload.stats"]),
+	("preprocess", [], ["file_format", "filter_options"],
+		["100.preprocess.passed.fna", "100.preprocess.removed.fna"]),
+	("dereplicate", ["preprocess"], ["prefix_length", "dereplicate"],
+		["150.dereplication.passed.fna", "150.dereplication.removed.fna"]),
+	("bowtie-screen", ["dereplicate"], ["screen_indexes", "bowtie"],
+		["299.screen.passed.fna"]),
+	("genecalling", ["bowtie-screen"], ["fgs_type"],
+		["350.genecalling.coding.faa", "350.genecalling.coding.fna"]),
+	("cluster-aa", ["genecalling"], ["aa_pid"],
+		["550.cluster.aa%(aa_pid)s.faa", "550.cluster.aa%(aa_pid)s.mapping"]),
+	("blat-prot", ["cluster-aa"], [],
+		["650.superblat.sims"]),
+	("search-rna", ["preprocess"], ["m5rna_clust"],
+		["425.search.rna.fna"]),
+	("cluster-rna", ["search-rna"], ["rna_pid"],
+		["440.cluster.rna%(rna_pid)s.fna", "440.cluster.rna%(rna_pid)s.mapping"]),
+	("blat-rna", ["cluster-rna"], ["assembled"],
+		["450.rna.sims"])
+]
+
+# Cached stages whose outputs are only read by other cached stages. They can be
+# skipped when all of the stages that read them are cached
+INTERMEDIATE_STAGES = set(["preprocess", "dereplicate", "bowtie-screen"])
+
+# Stages after the cached ones, with the stages they read from and the settings that
+# change their outputs. They are never cached, but are shared by the variants of a
+# parameter sweep like the cached stages
+ANNOTATION_STAGES = [
+	("annotate-sims-aa", ["blat-prot"], ["ach_annotation_ver"]),
+	("annotate-sims-rna", ["blat-rna"], ["ach_annotation_ver"]),
+	("index", ["genecalling", "cluster-aa", "annotate-sims-aa", "search-rna", "cluster-rna", "annotate-sims-rna"],
+		["ach_annotation_ver"]),
+	("summary", ["qc", "cluster-aa", "annotate-sims-aa", "cluster-rna", "annotate-sims-rna", "index"],
+		["ach_annotation_ver"])
+]
+
+# Every stage of the pipeline with the stages it reads from and its settings, in pipeline order
+PIPELINE_STAGES = [(stage, parents, settings) for stage, parents, settings, outputs in CACHED_STAGES] + ANNOTATION_STAGES
+
+# The settings that can be swept
+SWEEP_SETTINGS = set(setting for stage, parents, settings in PIPELINE_STAGES for setting in settings)
+
+# Added to the Condor priorities of the jobs of a preview workflow, so that they
+# are started before the jobs of full workflows
+PREVIEW_PRIORITY = 100000
+
+# The jobs of a preview workflow get walltimes scaled down with the fraction of the
+# reads they process, but no shorter than this many minutes (or their full walltime,
+# if that is shorter). Jobs that would be shorter get fewer cores instead
+PREVIEW_WALLTIME = 20
+
+# File name extension of each supported compression
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+def unique(items):
+	"Return 'items' without duplicates, in their original order"
+	seen = set()
+	result = []
+	for item in items:
+		if item not in seen:
+			seen.add(item)
+			result.append(item)
+	return result
+
+def scale_resources(default, scale):
+	"Scale the 'default' resources of a job down to 'scale', the fraction of the reads it processes. The walltime shrinks with the work, but not below PREVIEW_WALLTIME minutes or the default walltime, whichever is shorter. The core count shrinks instead, but only for jobs held at a floor shorter than their default walltime"
+	floor = min(default.walltime, PREVIEW_WALLTIME)
+	walltime = default.walltime * scale
+	count = default.count
+	if walltime < floor:
+		if count is not None and floor < default.walltime:
+			count = max(1, int(math.ceil(count * walltime / floor)))
+		walltime = floor
+	return Resources(int(math.ceil(walltime)), count, default.memory)
+
+def sweep_label(value):
+	"Return the swept setting value 'value' as it appears in file names"
+	return re.sub(r"[^A-Za-z0-9_-]", "_", value)
+
 class MGRASTWorkflow(object):
 
-	def __init__(self, outdir, config, mgfile):
-		"'outdir' is the directory where the workflow is written, and 'config' is a ConfigParser object"
+	def __init__(self, outdir, config, samples, scales=None):
+		"'outdir' is the directory where the workflow is written, 'config' is a ConfigParser object, and 'samples' is a list of (name, metagenome file) pairs. The name is None when the workflow processes a single metagenome. 'scales' is given for a preview workflow, and maps every metagenome file to the fraction of the reads of the full metagenome it holds"
 		self.outdir = outdir
 		self.config = config
-		self.mgfile = mgfile
+		self.samples = samples
 		self.daxfile = os.path.join(self.outdir, "dax.xml")
 		self.replicas = {}
+		self.stages = []
+		self.stats = {}
+		self.graph = StageGraph()
+		self.job_resources = {}
+		self.job_files = {}
+		self.scales = scales or {}
+		self.scale = 1.0
 
 		# Get all the values from the config file
 		self.file_format = config.get("simulation", "file_format")
@@ -31,7 +143,103 @@ class MGRASTWorkflow(object):
 		self.aa_pid = config.get("simulation", "aa_pid")
 		self.ach_annotation_ver = config.get("simulation", "ach_annotation_ver")
 		self.rna_pid = config.get("simulation", "rna_pid")
-
+		self.blat_prot_shards = int(self.get_option("blat_prot_shards", 1))
+		self.chunk_size = int(self.get_option("chunk_size", 0))
+		self.max_chunks = int(self.get_option("max_chunks", 32))
+		self.combined_summary = int(self.get_option("combined_summary", 1))
+
+		# With summary_db = 1, the summaries of every sample are loaded into an SQLite store,
+		# and the stores of a batch or sweep are merged into one
+		self.summary_db = int(self.get_option("summary_db", 0))
+		self.summary_stores = []
+		self.coschedule_screen = int(self.get_option("coschedule_screen", 0))
+
+		# A parameter sweep runs the pipeline for every combination of the values given in
+		# the sweep section. Stages whose settings and inputs are the same in several
+		# variants are run once and shared by them
+		self.sweep = []
+		if config.has_section("sweep"):
+			for setting in config.options("sweep"):
+				if setting not in SWEEP_SETTINGS:
+					raise Exception("Cannot sweep %s" % setting)
+				values = config.get("sweep", setting).split()
+				if len(values) == 0:
+					raise Exception("No values to sweep for %s" % setting)
+				if len(set(sweep_label(value) for value in values)) != len(values):
+					raise Exception("The values of %s are not distinct: %s" % (setting, " ".join(values)))
+				self.sweep.append((setting, values))
+		self.variants = [dict(zip([setting for setting, values in self.sweep], combination))
+			for combination in itertools.product(*[values for setting, values in self.sweep])]
+		self.emitted = set()
+		self.digests = {}
+
+		# The co-scheduled job does not keep 150.dereplication.passed.fna, so it is not used when the
+		# variants differ in a setting of dereplicate or bowtie-screen
+		screenSettings = set(setting for stage, parents, settings in PIPELINE_STAGES
+			if stage in ("dereplicate", "bowtie-screen") for setting in settings)
+		if screenSettings & set(setting for setting, values in self.sweep if len(values) > 1):
+			self.coschedule_screen = 0
+
+		# Jobs with a walltime of at most cluster_walltime minutes are run together in one
+		# allocation: by label (groups of connected short jobs) or by level (same
+		# transformation at the same depth, cluster_size jobs at a time)
+		self.clustering = self.get_option("clustering", "") or None
+		if self.clustering not in (None, "label", "level"):
+			raise Exception("Unknown clustering: %s" % self.clustering)
+		self.cluster_walltime = int(self.get_option("cluster_walltime", 30))
+		self.cluster_size = int(self.get_option("cluster_size", 8))
+
+		# Intermediate files are kept compressed if a compression is given, except for the
+		# outputs of the stages (transformations) listed in uncompressed_stages
+		self.compression = self.get_option("compression", "") or None
+		if self.compression is not None and self.compression not in COMPRESSION_EXTENSIONS:
+			raise Exception("Unknown compression: %s" % self.compression)
+		self.uncompressed_stages = set(s.strip() for s in self.get_option("uncompressed_stages", "").split(",") if s.strip())
+		self.compressed = set()
+		self.compressed_files = {}
+
+		# A preview workflow on a sample of the reads is written next to the workflow if
+		# preview_reads or preview_percent is set
+		self.preview_reads = int(self.get_option("preview_reads", 0))
+		self.preview_percent = float(self.get_option("preview_percent", 0))
+		self.preview_sampling = self.get_option("preview_sampling", "stride")
+		if self.preview_sampling not in SAMPLING_METHODS:
+			raise Exception("Unknown preview_sampling: %s" % self.preview_sampling)
+
+		# Stage outputs are reused from earlier runs if a cache directory is given. Preview
+		# workflows do not use the cache, so that their small outputs do not evict others.
+		# The entries a workflow reuses are not evicted for cache_lease hours, while it runs
+		self.pipeline_version = self.get_option("pipeline_version", "")
+		cachedir = self.get_option("cache_dir", None)
+		if cachedir and scales is None:
+			cachesize = int(float(self.get_option("cache_size", 100)) * 1024 * 1024 * 1024)
+			cachelease = int(float(self.get_option("cache_lease", 48)) * 3600)
+			self.cache = StageCache(os.path.abspath(cachedir), cachesize, cachelease)
+		else:
+			self.cache = None
+
+		# Reference databases are staged to node-local scratch by the wrappers if a
+		# manifest is given (see refdb.py), otherwise they are read from MGRAST_DIR
+		manifest = self.get_option("refdb_manifest", None)
+		if manifest:
+			self.refdbs = read_refdb_manifest(manifest)
+			self.add_replica("refdbs.json", os.path.abspath(manifest))
+		else:
+			self.refdbs = None
+
+		# Walltimes, core counts and memory are learned from earlier runs if a
+		# model is given (see resources.py), otherwise the defaults are used
+		modelfile = self.get_option("resource_model", None)
+		if modelfile:
+			self.model = ResourceModel.load(modelfile)
+		else:
+			self.model = ResourceModel()
+
+	def get_option(self, name, default):
+		"Return the value of an optional setting in the simulation section, or 'default' if it is not set"
+		if self.config.has_option("simulation", name):
+			return self.config.get("simulation", name)
+		return default
 
 	def add_replica(self, name, path):
 		"Add a replica entry to the replica catalog for the workflow"
@@ -54,435 +262,926 @@ class MGRASTWorkflow(object):
 		finally:
 			f.close()
 
-	def generate_workflow(self):
-		"Generate a workflow (DAX, config files, and replica catalog)"
-		ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-		dax = ADAG("mgrast-prod-%s" % ts)
-		
-		# These are all the global input files for the workflow
-		metagenome = File(self.mgfile)
-		self.add_replica(self.mgfile, os.path.abspath(self.mgfile))
+	def part_name(self, name, i):
+		"Return the name of the i-th chunk of the file 'name', keeping its extension"
+		root, ext = os.path.splitext(name)
+		return "%s.part%d%s" % (root, i, ext)
+
+	def split_fasta(self, dax, name, parts, size, chunkname=None):
+		"Add a job that splits the FASTA file 'name' into 'parts' record-aligned chunks, named after 'chunkname' (by default 'name'). Returns the job and the chunk names"
+		chunks = [self.part_name(chunkname or name, i) for i in range(parts)]
+
+		splitJob = Job("wrapper-split-fasta", node_label="wrapper-split-fasta")
+		splitJob.addArguments("-input=%s" % name)
+		for chunk in chunks:
+			splitJob.addArguments("-output=%s" % chunk)
+
+		self.uses(splitJob, name, link=Link.INPUT)
+		for chunk in chunks:
+			self.uses(splitJob, chunk, link=Link.OUTPUT, transfer=False)
+
+		self.resources(splitJob, size, walltime=20)
+		dax.addJob(splitJob)
+		return splitJob, chunks
+
+	def merge_files(self, dax, merges, size):
+		"Add a job that rebuilds files from their chunks. 'merges' is a list of (name, parts) pairs; each name is the concatenation of its parts. Returns the job"
+		mergeJob = Job("wrapper-merge", node_label="wrapper-merge")
+		for name, parts in merges:
+			mergeJob.addArguments("-output=%s" % name)
+			for part in parts:
+				mergeJob.addArguments("-input=%s" % part)
+
+		for name, parts in merges:
+			for part in parts:
+				self.uses(mergeJob, part, link=Link.INPUT)
+			self.uses(mergeJob, name, link=Link.OUTPUT, transfer=False)
+
+		self.resources(mergeJob, size, walltime=20)
+		dax.addJob(mergeJob)
+		return mergeJob
+
+	def resources(self, job, size, walltime, count=None, memory=None, stage=None):
+		"Set the walltime and core count profiles of 'job', which processes 'size' bytes of the metagenome, and return its Resources. 'walltime', 'count' and 'memory' are the defaults, used when the resource model has no history for the job's stage. 'stage' defaults to the job's transformation"
+		if stage is None:
+			stage = job.name
+		default = Resources(walltime, count, memory)
+		if self.scale < 1:
+			default = scale_resources(default, self.scale)
+		res = self.model.estimate(stage, size, default)
+
+		job.profile("globus", "maxwalltime", str(res.walltime))
+		if res.count is not None:
+			job.profile("globus", "hostcount", str(res.count))
+			job.profile("globus", "count", str(res.count))
+			job.profile("env", "OMP_NUM_THREADS", str(res.count))
+		self.stages.append((job, stage, size))
+		self.graph.add_job(job, res.walltime)
+		self.job_resources[id(job)] = res
+		return res
+
+	def lfn(self, name):
+		"Return the logical file name under which the file 'name' is kept in the workflow"
+		if name in self.compressed:
+			return name + COMPRESSION_EXTENSIONS[self.compression]
+		return name
+
+	def uses(self, job, name, link, transfer=None):
+		"Declare that 'job' reads or writes the file 'name'. With compression set, intermediate outputs are kept compressed: they are declared under a compressed name, and the job's wrapper is told to decompress and compress them under their plain names"
+		inputs, outputs = self.job_files.setdefault(id(job), ([], []))
+		if isinstance(name, File):
+			inputs.append(name.name)
+			job.uses(name, link=link, transfer=transfer)
+			return
+		self.graph.add_use(job, name, link == Link.OUTPUT)
+
+		if self.compression is not None:
+			if link == Link.OUTPUT and not transfer and job.name not in self.uncompressed_stages:
+				self.compressed.add(name)
+			if name in self.compressed:
+				compressed_inputs, compressed_outputs = self.compressed_files.setdefault(id(job), (job, [], []))[1:]
+				if link == Link.OUTPUT:
+					compressed_outputs.append(name)
+				else:
+					compressed_inputs.append(name)
+
+		if link == Link.OUTPUT:
+			outputs.append(self.lfn(name))
+		else:
+			inputs.append(self.lfn(name))
+		job.uses(self.lfn(name), link=link, transfer=transfer)
+
+	def generate_dependencies(self, dax):
+		"Add the transitive reduction of the dependencies to the DAX, and give every job a priority from the length of the longest path from it to the end of the workflow, so that the jobs on long branches are released first. The jobs of a preview workflow get PREVIEW_PRIORITY more. Returns the critical path and its length in minutes"
+		for parent, child in self.graph.reduced_edges():
+			dax.depends(child, parent)
+
+		levels = self.graph.bottom_levels()
+		boost = PREVIEW_PRIORITY if self.scales else 0
+		for job in self.graph.nodes:
+			job.profile("condor", "priority", str(levels[id(job)] + boost))
+		return self.graph.critical_path()
+
+	def generate_clusters(self):
+		"Mark the short jobs for Pegasus job clustering, and write the clustering mode for plan.sh"
+		if self.clustering is None:
+			return
+
+		short = [job for job in self.graph.nodes if self.graph.runtimes[id(job)] <= self.cluster_walltime]
+		if self.clustering == "label":
+			groups = self.graph.convex_groups(short)
+			for i, group in enumerate(groups):
+				# A clustered job runs the commands of its group in one allocation, so every
+				# job of the group asks for the largest core count in it
+				counts = [self.job_resources[id(job)].count for job in group if id(job) in self.job_resources]
+				count = max([c for c in counts if c is not None] or [None])
+				for job in group:
+					job.profile("pegasus", "label", "cluster%d" % (i + 1))
+					res = self.job_resources.get(id(job))
+					if count is not None and (res is None or res.count is None):
+						job.profile("globus", "hostcount", str(count))
+						job.profile("globus", "count", str(count))
+		else:
+			for job in short:
+				job.profile("pegasus", "clusters.size", str(self.cluster_size))
+
+		# With pegasus-mpi-cluster as the aggregator, each task gets its own cores and memory
+		for job in short:
+			res = self.job_resources.get(id(job))
+			if res is None:
+				continue
+			if res.count is not None:
+				job.profile("pegasus", "pmc_request_cpus", str(res.count))
+			if res.memory is not None:
+				job.profile("pegasus", "pmc_request_memory", str(res.memory * 1024))
+
+		path = os.path.join(self.outdir, "clustering")
+		f = open(path, "w")
+		try:
+			f.write({"label": "label", "level": "horizontal"}[self.clustering] + "\n")
+		finally:
+			f.close()
 
-		# QC job
-		qcJob = Job("wrapper-qc", node_label="wrapper-qc")
+	def generate_compression_profiles(self):
+		"Tell the wrapper of every job which of its files are compressed"
+		for job, inputs, outputs in self.compressed_files.values():
+			job.profile("env", "COMPRESSION", self.compression)
+			if inputs:
+				job.profile("env", "COMPRESSED_INPUTS", " ".join(inputs))
+			if outputs:
+				job.profile("env", "COMPRESSED_OUTPUTS", " ".join(outputs))
+
+	def generate_telemetry_profiles(self):
+		"Tell the telemetry collector in the wrapper of every job its DAX job ID and the files to measure"
+		for job in self.graph.nodes:
+			job.profile("env", "TELEMETRY_JOB", job.id)
+			inputs, outputs = self.job_files.get(id(job), ([], []))
+			if inputs:
+				job.profile("env", "TELEMETRY_INPUTS", " ".join(inputs))
+			if outputs:
+				job.profile("env", "TELEMETRY_OUTPUTS", " ".join(outputs))
+
+	def use_reference_dbs(self, job, names):
+		"Make 'job' stage the reference databases 'names' listed in the manifest before it runs. Does nothing without a manifest"
+		if self.refdbs is None:
+			return
+		for name in names:
+			if name not in self.refdbs:
+				raise Exception("Reference database %s is not in the manifest" % name)
+		job.uses("refdbs.json", link=Link.INPUT)
+		job.profile("env", "REFDBS", " ".join(names))
+
+	def generate_job_sizes(self):
+		"Write the stage, input size and requested walltime and cores of every job, keyed by DAX job ID, so resources.py can learn from this run and telemetry.py can report on it"
+		jobs = {}
+		for job, stage, size in self.stages:
+			res = self.job_resources[id(job)]
+			jobs[job.id] = {"stage": stage, "input_size": size, "walltime": res.walltime, "count": res.count}
+		path = os.path.join(self.outdir, "jobs.json")
+		f = open(path, "w")
+		try:
+			json.dump(jobs, f, indent=2, sort_keys=True)
+		finally:
+			f.close()
 
-		qcJob.addArguments("-input", self.mgfile)
-		qcJob.addArguments("-format", self.file_format)
-		qcJob.addArguments("-out_prefix", "075")
-		qcJob.addArguments("-assembled", self.assembled)
-		qcJob.addArguments("-filter_options", self.filter_options)
-		qcJob.addArguments("-proc", "8")
+	def depends(self, child, *parents):
+		"Make 'child' depend on each of 'parents' that is in the workflow. Parents of cached stages are None and are skipped. The edges are added to the DAX by generate_dependencies()"
+		for parent in parents:
+			if parent is not None:
+				self.graph.add_edge(parent, child)
+
+	def stage_namespaces(self, prefix, variant):
+		"Return the file name prefix of every stage of the pipeline in the sweep variant 'variant': 'prefix', followed by the swept settings that change the outputs of the stage, directly or through the stages it reads from, and their values"
+		swept = {}
+		ns = {}
+		for stage, parents, settings in PIPELINE_STAGES:
+			swept[stage] = set(setting for setting in settings if setting in variant)
+			for parent in parents:
+				swept[stage] |= swept[parent]
+			ns[stage] = prefix + "".join("%s_%s." % (setting, sweep_label(variant[setting]))
+				for setting, values in self.sweep if setting in swept[stage] and len(values) > 1)
+		return ns
+
+	def cached_stages(self, ns, mgfile):
+		"Look up the stages of the pipeline for 'mgfile' in the stage cache, and register the outputs of cached stages as replicas. Stages already added to the workflow by another variant of a sweep are shared. 'ns' holds the file name prefix of every stage. Returns the cache keys of the stages and the set of stages that have to run"
+		stages = [stage for stage, parents, settings in PIPELINE_STAGES]
+		available = set(stage for stage in stages if (stage, ns[stage]) in self.emitted)
+
+		keys = {}
+		if self.cache is not None:
+			if mgfile not in self.digests:
+				self.digests[mgfile] = file_digest(mgfile)
+			for stage, parents, settings, outputs in CACHED_STAGES:
+				arguments = [getattr(self, setting) for setting in settings]
+				if self.compression is not None:
+					# Compressed outputs are stored under their compressed names
+					arguments += [self.compression, sorted(self.uncompressed_stages)]
+				parentKeys = [keys[parent] for parent in parents] or [self.digests[mgfile]]
+				keys[stage] = stage_key(stage, self.pipeline_version, arguments, parentKeys)
+				if stage in available:
+					continue
+				files = self.cache.lookup(keys[stage])
+				if files is not None:
+					available.add(stage)
+					for name, path in files.items():
+						if self.compression is not None and name.endswith(COMPRESSION_EXTENSIONS[self.compression]):
+							self.compressed.add(ns[stage] + os.path.splitext(name)[0])
+						self.add_replica(ns[stage] + name, path)
+
+		# Walk backwards, so every stage is decided after the stages that read from it
+		run = set()
+		for stage, parents, settings in reversed(PIPELINE_STAGES):
+			if stage in available:
+				continue
+			if stage not in INTERMEDIATE_STAGES:
+				run.add(stage)
+			for parent in parents:
+				if stage in run:
+					run.add(parent)
+		run -= available
+		self.emitted |= set((stage, ns[stage]) for stage in run | available)
+		return keys, run
+
+	def cache_outputs(self, dax, job, ns, keys, stage, size):
+		"Add a job that stores the outputs of 'stage' in the stage cache once 'job' has produced them"
+		if self.cache is None:
+			return
+
+		storeJob = Job("wrapper-cache-store", node_label="wrapper-cache-store")
+		storeJob.addArguments(self.cache.path, str(self.cache.max_size), keys[stage])
+		outputs = [o for name, parents, settings, o in CACHED_STAGES if name == stage][0]
+		for name in outputs:
+			lfn = self.lfn(ns[stage] + name % vars(self))
+			storeJob.addArguments("%s=%s" % (lfn[len(ns[stage]):], lfn))
+			storeJob.uses(lfn, link=Link.INPUT)
+
+		self.resources(storeJob, size, walltime=20)
+		dax.addJob(storeJob)
+		self.depends(storeJob, job)
+
+	def profile_inputs(self):
+		"Scan every metagenome with inputstats.profile(), and check that its format matches the file_format setting"
+		for name, mgfile in self.samples:
+			stats = profile(mgfile)
+			if stats["format"] != self.file_format.lower():
+				raise Exception("%s is %s, but file_format is %s" % (mgfile, stats["format"], self.file_format))
+			self.stats[mgfile] = stats
+
+	def generate_input_stats(self):
+		"Write the statistics of every metagenome, keyed by file name, next to the DAX"
+		path = os.path.join(self.outdir, "inputstats.json")
+		f = open(path, "w")
+		try:
+			json.dump(self.stats, f, indent=2, sort_keys=True)
+		finally:
+			f.close()
 
-		qcJob.uses(metagenome, link=Link.INPUT)
-		qcJob.uses("075.assembly.coverage", link=Link.OUTPUT, transfer=False)
-		qcJob.uses("075.qc.stats", link=Link.OUTPUT, transfer=False)
-		qcJob.uses("075.upload.stats", link=Link.OUTPUT, transfer=False)
+	def read_chunks(self, mgfile):
+		"Return the number of chunks the reads are split into for the chunked stages, derived from the uncompressed size of the metagenome"
+		if self.chunk_size <= 0:
+			return 1
+		stats = self.stats[mgfile]
+		chunks = int(math.ceil(float(stats["size"]) / (self.chunk_size * 1024 * 1024)))
+		return max(1, min(chunks, self.max_chunks, stats["reads"]))
+
+	def add_pipeline(self, dax, name, mgfile, variant=None):
+		"Add the jobs that process the metagenome 'mgfile' to 'dax'. If 'name' is set, it prefixes every file of the pipeline so that several metagenomes can share one workflow. 'variant' maps the swept settings to their values in this run of the pipeline"
+		if name:
+			prefix = "%s." % name
+			mglfn = prefix + os.path.basename(mgfile)
+		else:
+			prefix = ""
+			mglfn = mgfile
+
+		# The files of every stage are prefixed with the swept settings it depends on, so
+		# stages that do not depend on any have the same files in every variant
+		variant = variant or {}
+		for setting, value in variant.items():
+			setattr(self, setting, value)
+		ns = self.stage_namespaces(prefix, variant)
+
+		# Jobs are sized by the uncompressed size of the metagenome. In a preview workflow,
+		# the default resources are scaled down to the sampled fraction of the reads
+		size = self.stats[mgfile]["size"]
+		self.scale = self.scales.get(mgfile, 1.0)
+
+		# These are all the global input files for the pipeline
+		metagenome = File(mglfn)
+		self.add_replica(mglfn, os.path.abspath(mgfile))
+
+		# Stages found in the stage cache or shared with another variant are not run: the
+		# outputs of cached stages are registered as replicas instead, and their jobs stay None
+		# so the dependencies on them are dropped
+		keys, run = self.cached_stages(ns, mgfile)
+		qcJob = preprocessJob = dereplicateJob = bowtieJob = geneJob = cluster1Job = blatprotJob = None
+		searchJob = cluster2Job = blatrnaJob = annotatesims1Job = annotatesims2Job = indexJob = None
+
+		# The genecalling and search-rna stages are split into chunks of at most chunk_size MB
+		# (estimated from the metagenome size), each chunk is processed by its own job, and the
+		# outputs are merged back
+		chunks = self.read_chunks(mgfile)
 
-		qcJob.profile("globus", "maxwalltime", "60")
-		qcJob.profile("globus", "hostcount", "8")
-		qcJob.profile("globus", "count", "8")
-		dax.addJob(qcJob)
+		# QC job
+		if "qc" in run:
+			qcJob = Job("wrapper-qc", node_label="wrapper-qc")
+			res = self.resources(qcJob, size, walltime=60, count=8)
+
+			qcJob.addArguments("-input", mglfn)
+			qcJob.addArguments("-format", self.file_format)
+			qcJob.addArguments("-out_prefix", "%s075" % ns["qc"])
+			qcJob.addArguments("-assembled", self.assembled)
+			qcJob.addArguments("-filter_options", self.filter_options)
+			qcJob.addArguments("-proc", str(res.count))
+
+			self.uses(qcJob, metagenome, link=Link.INPUT)
+			self.uses(qcJob, "%s075.assembly.coverage" % ns["qc"], link=Link.OUTPUT, transfer=False)
+			self.uses(qcJob, "%s075.qc.stats" % ns["qc"], link=Link.OUTPUT, transfer=False)
+			self.uses(qcJob, "%s075.upload.stats" % ns["qc"], link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(qcJob)
+			self.cache_outputs(dax, qcJob, ns, keys, "qc", size)
+
+		# With coschedule_screen = 1, preprocess, dereplicate and bowtie-screen run one after
+		# another in one job, and so in one allocation. 150.dereplication.passed.fna stays in the
+		# job's scratch; 100.preprocess.passed.fna, which search-rna also reads, and the removed
+		# reads are written out. The stages are run separately when some of them are cached
+		coscheduled = self.coschedule_screen and set(["preprocess", "dereplicate", "bowtie-screen"]) <= run
+		if coscheduled:
+			screenJob = Job("wrapper-preprocess-screen", node_label="wrapper-preprocess-screen")
+			res = self.resources(screenJob, size, walltime=60, count=8, memory=10)
+			self.use_reference_dbs(screenJob, self.screen_indexes.split(","))
+			screenJob.addArguments("-stage=preprocess")
+			screenJob.addArguments("-input=%s" % mglfn)
+			screenJob.addArguments("-format=%s" % self.file_format)
+			screenJob.addArguments("-out_prefix=%s100.preprocess" % ns["preprocess"])
+			screenJob.addArguments("-filter_options=%s" % self.filter_options)
+			screenJob.addArguments("-stage=dereplicate")
+			screenJob.addArguments("-input=%s100.preprocess.passed.fna" % ns["preprocess"])
+			screenJob.addArguments("-out_prefix=%s150.dereplication" % ns["dereplicate"])
+			screenJob.addArguments("-prefix_length=%s" % self.prefix_length)
+			screenJob.addArguments("-dereplicate=%s" % self.dereplicate)
+			screenJob.addArguments("-memory=%d" % res.memory)
+			screenJob.addArguments("-stage=bowtie-screen")
+			screenJob.addArguments("-input=%s150.dereplication.passed.fna" % ns["dereplicate"])
+			screenJob.addArguments("-output=%s299.screen.passed.fna" % ns["bowtie-screen"])
+			screenJob.addArguments("-index=%s" % self.screen_indexes)
+			screenJob.addArguments("-bowtie=%s" % self.bowtie)
+			screenJob.addArguments("-proc=%d" % res.count)
+
+			self.uses(screenJob, metagenome, link=Link.INPUT)
+			self.uses(screenJob, "%s100.preprocess.passed.fna" % ns["preprocess"], link=Link.OUTPUT, transfer=False)
+			self.uses(screenJob, "%s100.preprocess.removed.fna" % ns["preprocess"], link=Link.OUTPUT, transfer=False)
+			self.uses(screenJob, "%s150.dereplication.removed.fna" % ns["dereplicate"], link=Link.OUTPUT, transfer=False)
+			self.uses(screenJob, "%s299.screen.passed.fna" % ns["bowtie-screen"], link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(screenJob)
+			preprocessJob = dereplicateJob = bowtieJob = screenJob
+
+			# 150.dereplication.passed.fna only exists inside the job, so dereplicate is not cached
+			self.cache_outputs(dax, screenJob, ns, keys, "preprocess", size)
+			self.cache_outputs(dax, screenJob, ns, keys, "bowtie-screen", size)
 
 		# Preprocess Job
-		preprocessJob = Job("wrapper-preprocess", node_label="wrapper-preprocess")
-		preprocessJob.addArguments("-input", self.mgfile)
-		preprocessJob.addArguments("-format", self.file_format)
-		preprocessJob.addArguments("-out_prefix", "100.preprocess")
-		preprocessJob.addArguments("-filter_options", self.filter_options)
-		
-		preprocessJob.uses(metagenome, link=Link.INPUT)
-		preprocessJob.uses("100.preprocess.passed.fna", link=Link.OUTPUT, transfer=False)
-		preprocessJob.uses("100.preprocess.removed.fna", link=Link.OUTPUT, transfer=False)
-
-		preprocessJob.profile("globus", "maxwalltime", "20")
-		dax.addJob(preprocessJob)
+		if "preprocess" in run and not coscheduled:
+			preprocessJob = Job("wrapper-preprocess", node_label="wrapper-preprocess")
+			preprocessJob.addArguments("-input", mglfn)
+			preprocessJob.addArguments("-format", self.file_format)
+			preprocessJob.addArguments("-out_prefix", "%s100.preprocess" % ns["preprocess"])
+			preprocessJob.addArguments("-filter_options", self.filter_options)
 
-		# Dereplicate Job
-		dereplicateJob = Job("wrapper-dereplicate", node_label="wrapper-dereplicate")
-		dereplicateJob.addArguments("-input=100.preprocess.passed.fna")
-		dereplicateJob.addArguments("-out_prefix=150.dereplication")
-		dereplicateJob.addArguments("-prefix_length=%s" % self.prefix_length)
-		dereplicateJob.addArguments("-dereplicate=%s" % self.dereplicate)
-		dereplicateJob.addArguments("-memory=10")
+			self.uses(preprocessJob, metagenome, link=Link.INPUT)
+			self.uses(preprocessJob, "%s100.preprocess.passed.fna" % ns["preprocess"], link=Link.OUTPUT, transfer=False)
+			self.uses(preprocessJob, "%s100.preprocess.removed.fna" % ns["preprocess"], link=Link.OUTPUT, transfer=False)
 
-		dereplicateJob.uses("100.preprocess.passed.fna", link=Link.INPUT)
-		dereplicateJob.uses("150.dereplication.passed.fna", link=Link.OUTPUT, transfer=False)
-		dereplicateJob.uses("150.dereplication.removed.fna", link=Link.OUTPUT, transfer=False)
+			self.resources(preprocessJob, size, walltime=20)
+			dax.addJob(preprocessJob)
+			self.cache_outputs(dax, preprocessJob, ns, keys, "preprocess", size)
 
-		dereplicateJob.profile("globus", "maxwalltime", "10")
-		dax.addJob(dereplicateJob)
-		dax.depends(dereplicateJob, preprocessJob)
+		# Dereplicate Job
+		if "dereplicate" in run and not coscheduled:
+			dereplicateJob = Job("wrapper-dereplicate", node_label="wrapper-dereplicate")
+			res = self.resources(dereplicateJob, size, walltime=10, memory=10)
+			dereplicateJob.addArguments("-input=%s100.preprocess.passed.fna" % ns["preprocess"])
+			dereplicateJob.addArguments("-out_prefix=%s150.dereplication" % ns["dereplicate"])
+			dereplicateJob.addArguments("-prefix_length=%s" % self.prefix_length)
+			dereplicateJob.addArguments("-dereplicate=%s" % self.dereplicate)
+			dereplicateJob.addArguments("-memory=%d" % res.memory)
+
+			self.uses(dereplicateJob, "%s100.preprocess.passed.fna" % ns["preprocess"], link=Link.INPUT)
+			self.uses(dereplicateJob, "%s150.dereplication.passed.fna" % ns["dereplicate"], link=Link.OUTPUT, transfer=False)
+			self.uses(dereplicateJob, "%s150.dereplication.removed.fna" % ns["dereplicate"], link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(dereplicateJob)
+			self.depends(dereplicateJob, preprocessJob)
+			self.cache_outputs(dax, dereplicateJob, ns, keys, "dereplicate", size)
 
 		# Bowtie Screen Job
-		bowtieJob = Job("wrapper-bowtie-screen", node_label="wrapper-bowtie-screen")
-		bowtieJob.addArguments("-input=150.dereplication.passed.fna")
-		bowtieJob.addArguments("-output=299.screen.passed.fna")
-		bowtieJob.addArguments("-index=%s" % self.screen_indexes)
-		bowtieJob.addArguments("-bowtie=%s" % self.bowtie)
-		bowtieJob.addArguments("-proc=8")
-
-		bowtieJob.uses("150.dereplication.passed.fna", link=Link.INPUT)
-		bowtieJob.uses("299.screen.passed.fna", link=Link.OUTPUT, transfer=False)
-
-		bowtieJob.profile("globus", "maxwalltime", "30")
-		bowtieJob.profile("globus", "hostcount", "8")
-		bowtieJob.profile("globus", "count", "8")
-		dax.addJob(bowtieJob)
-		dax.depends(bowtieJob, dereplicateJob)
-
-		# Genecalling Job
-		geneJob = Job("wrapper-genecalling", node_label="wrapper-genecalling")
-		geneJob.addArguments("-input=299.screen.passed.fna")
-		geneJob.addArguments("-out_prefix=350.genecalling.coding")
-		geneJob.addArguments("-type=%s" % self.fgs_type)
-		geneJob.addArguments("-size=100")
-		geneJob.addArguments("-proc=8")
-
-		geneJob.uses("299.screen.passed.fna", link=Link.INPUT)
-		geneJob.uses("350.genecalling.coding.faa", link=Link.OUTPUT, transfer=False)
-		geneJob.uses("350.genecalling.coding.fna", link=Link.OUTPUT, transfer=False)
-
-		geneJob.profile("globus", "maxwalltime", "30")
-		geneJob.profile("globus", "hostcount", "8")
-		geneJob.profile("globus", "count", "8")
-		dax.addJob(geneJob)
-		dax.depends(geneJob, bowtieJob)
+		if "bowtie-screen" in run and not coscheduled:
+			bowtieJob = Job("wrapper-bowtie-screen", node_label="wrapper-bowtie-screen")
+			res = self.resources(bowtieJob, size, walltime=30, count=8)
+			self.use_reference_dbs(bowtieJob, self.screen_indexes.split(","))
+			bowtieJob.addArguments("-input=%s150.dereplication.passed.fna" % ns["dereplicate"])
+			bowtieJob.addArguments("-output=%s299.screen.passed.fna" % ns["bowtie-screen"])
+			bowtieJob.addArguments("-index=%s" % self.screen_indexes)
+			bowtieJob.addArguments("-bowtie=%s" % self.bowtie)
+			bowtieJob.addArguments("-proc=%d" % res.count)
+
+			self.uses(bowtieJob, "%s150.dereplication.passed.fna" % ns["dereplicate"], link=Link.INPUT)
+			self.uses(bowtieJob, "%s299.screen.passed.fna" % ns["bowtie-screen"], link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(bowtieJob)
+			self.depends(bowtieJob, dereplicateJob)
+			self.cache_outputs(dax, bowtieJob, ns, keys, "bowtie-screen", size)
+
+		# Genecalling Job(s)
+		if "genecalling" in run:
+			if chunks > 1:
+				splitJob, inputs = self.split_fasta(dax, "%s299.screen.passed.fna" % ns["bowtie-screen"], chunks, size,
+					"%s299.screen.passed.fna" % ns["genecalling"])
+				self.depends(splitJob, bowtieJob)
+				prefixes = ["%s350.genecalling.coding.part%d" % (ns["genecalling"], i) for i in range(chunks)]
+			else:
+				inputs = ["%s299.screen.passed.fna" % ns["bowtie-screen"]]
+				prefixes = ["%s350.genecalling.coding" % ns["genecalling"]]
+
+			geneJobs = []
+			for i in range(chunks):
+				geneJob = Job("wrapper-genecalling", node_label="wrapper-genecalling")
+				res = self.resources(geneJob, size // chunks, walltime=30, count=8)
+				geneJob.addArguments("-input=%s" % inputs[i])
+				geneJob.addArguments("-out_prefix=%s" % prefixes[i])
+				geneJob.addArguments("-type=%s" % self.fgs_type)
+				geneJob.addArguments("-size=100")
+				geneJob.addArguments("-proc=%d" % res.count)
+
+				self.uses(geneJob, inputs[i], link=Link.INPUT)
+				self.uses(geneJob, "%s.faa" % prefixes[i], link=Link.OUTPUT, transfer=False)
+				self.uses(geneJob, "%s.fna" % prefixes[i], link=Link.OUTPUT, transfer=False)
+
+				dax.addJob(geneJob)
+				if chunks > 1:
+					self.depends(geneJob, splitJob)
+				else:
+					self.depends(geneJob, bowtieJob)
+				geneJobs.append(geneJob)
+
+			if chunks > 1:
+				geneJob = self.merge_files(dax, [
+					("%s350.genecalling.coding.faa" % ns["genecalling"], ["%s.faa" % p for p in prefixes]),
+					("%s350.genecalling.coding.fna" % ns["genecalling"], ["%s.fna" % p for p in prefixes])], size)
+				for job in geneJobs:
+					self.depends(geneJob, job)
+			self.cache_outputs(dax, geneJob, ns, keys, "genecalling", size)
 
 		# Cluster (Genecalling) Job
-		cluster1Job = Job("wrapper-cluster", node_label="wrapper-cluster")
-		cluster1Job.addArguments("-input=350.genecalling.coding.faa")
-		cluster1Job.addArguments("-out_prefix=550.cluster")
-		cluster1Job.addArguments("-aa")
-		cluster1Job.addArguments("-pid=%s" % self.aa_pid)
-		cluster1Job.addArguments("-memory=20")
-
-		cluster1Job.uses("350.genecalling.coding.faa", link=Link.INPUT)
-		cluster1Job.uses("550.cluster.aa%s.faa" % self.aa_pid, link=Link.OUTPUT, transfer=False)
-		cluster1Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.OUTPUT, transfer=False)
-		
-		cluster1Job.profile("globus", "maxwalltime", "10")
-		dax.addJob(cluster1Job)
-		dax.depends(cluster1Job, geneJob)
-
-		# Blat_prot Job
-		blatprotJob = Job("wrapper-blat-prot", node_label="wrapper-blat-prot")
-		blatprotJob.addArguments("--input=550.cluster.aa%s.faa" % self.aa_pid)
-		blatprotJob.addArguments("--output=650.superblat.sims")
-
-		blatprotJob.uses("550.cluster.aa%s.faa" % self.aa_pid, link=Link.INPUT)
-		blatprotJob.uses("650.superblat.sims", link=Link.OUTPUT, transfer=False)
-		
-		blatprotJob.profile("globus", "maxwalltime", "2880")
-                blatprotJob.profile("globus", "hostcount", "24")
-                blatprotJob.profile("globus", "count", "24")
-		dax.addJob(blatprotJob)
-		dax.depends(blatprotJob, cluster1Job)
+		if "cluster-aa" in run:
+			cluster1Job = Job("wrapper-cluster", node_label="wrapper-cluster")
+			res = self.resources(cluster1Job, size, walltime=10, memory=20, stage="wrapper-cluster-aa")
+			cluster1Job.addArguments("-input=%s350.genecalling.coding.faa" % ns["genecalling"])
+			cluster1Job.addArguments("-out_prefix=%s550.cluster" % ns["cluster-aa"])
+			cluster1Job.addArguments("-aa")
+			cluster1Job.addArguments("-pid=%s" % self.aa_pid)
+			cluster1Job.addArguments("-memory=%d" % res.memory)
+
+			self.uses(cluster1Job, "%s350.genecalling.coding.faa" % ns["genecalling"], link=Link.INPUT)
+			self.uses(cluster1Job, "%s550.cluster.aa%s.faa" % (ns["cluster-aa"], self.aa_pid), link=Link.OUTPUT, transfer=False)
+			self.uses(cluster1Job, "%s550.cluster.aa%s.mapping" % (ns["cluster-aa"], self.aa_pid), link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(cluster1Job)
+			self.depends(cluster1Job, geneJob)
+			self.cache_outputs(dax, cluster1Job, ns, keys, "cluster-aa", size)
+
+		# Blat_prot Job(s)
+		# With blat_prot_shards > 1 the clustered proteins are split into record-aligned
+		# chunks, each chunk is searched by its own job, and the hits are merged back
+		if "blat-prot" in run:
+			clusterFaa = "%s550.cluster.aa%s.faa" % (ns["cluster-aa"], self.aa_pid)
+			shards = self.blat_prot_shards
+			if shards > 1:
+				splitJob, inputs = self.split_fasta(dax, clusterFaa, shards, size,
+					"%s550.cluster.aa%s.faa" % (ns["blat-prot"], self.aa_pid))
+				self.depends(splitJob, cluster1Job)
+				outputs = [self.part_name("%s650.superblat.sims" % ns["blat-prot"], i) for i in range(shards)]
+			else:
+				inputs = [clusterFaa]
+				outputs = ["%s650.superblat.sims" % ns["blat-prot"]]
+
+			blatprotJobs = []
+			for i in range(shards):
+				blatprotJob = Job("wrapper-blat-prot", node_label="wrapper-blat-prot")
+				res = self.resources(blatprotJob, size // shards, walltime=2880 // shards, count=24)
+				self.use_reference_dbs(blatprotJob, ["md5nr"])
+				blatprotJob.addArguments("--input=%s" % inputs[i])
+				blatprotJob.addArguments("--output=%s" % outputs[i])
+
+				self.uses(blatprotJob, inputs[i], link=Link.INPUT)
+				self.uses(blatprotJob, outputs[i], link=Link.OUTPUT, transfer=False)
+
+				dax.addJob(blatprotJob)
+				if shards > 1:
+					self.depends(blatprotJob, splitJob)
+				else:
+					self.depends(blatprotJob, cluster1Job)
+				blatprotJobs.append(blatprotJob)
+
+			if shards > 1:
+				blatprotJob = self.merge_files(dax, [("%s650.superblat.sims" % ns["blat-prot"], outputs)], size)
+				for job in blatprotJobs:
+					self.depends(blatprotJob, job)
+			self.cache_outputs(dax, blatprotJob, ns, keys, "blat-prot", size)
 
 		# Annotate Sims (Blat Prod) Job
-		annotatesims1Job = Job("wrapper-annotate-sims", node_label="wrapper-annotate-sims")
-		annotatesims1Job.addArguments("-input=650.superblat.sims")
-		annotatesims1Job.addArguments("-out_prefix=650")
-		annotatesims1Job.addArguments("-aa")
-		annotatesims1Job.addArguments("-ach_ver=%s" % self.ach_annotation_ver)
-		annotatesims1Job.addArguments("-ann_file=m5nr_v1.bdb")
-
-		annotatesims1Job.uses("650.superblat.sims", link=Link.INPUT)
-		annotatesims1Job.uses("650.aa.sims.filter", link=Link.OUTPUT, transfer=False)
-		annotatesims1Job.uses("650.aa.expand.protein", link=Link.OUTPUT, transfer=False)
-		annotatesims1Job.uses("650.aa.expand.lca", link=Link.OUTPUT, transfer=False)
-		annotatesims1Job.uses("650.aa.expand.ontology", link=Link.OUTPUT, transfer=False)
-		
-		annotatesims1Job.profile("globus", "maxwalltime", "720")
-		dax.addJob(annotatesims1Job)
-		dax.depends(annotatesims1Job, blatprotJob)
-
-		# Search RNA Job
-		searchJob = Job("wrapper-search-rna", node_label="wrapper-search-rna")
-		searchJob.addArguments("-input=100.preprocess.passed.fna")
-		searchJob.addArguments("-output=425.search.rna.fna")
-		searchJob.addArguments("-rna_nr=%s" % self.m5rna_clust)
-		searchJob.addArguments("-size=100")
-		searchJob.addArguments("-proc=8")
-
-		searchJob.uses("100.preprocess.passed.fna", link=Link.INPUT)
-		searchJob.uses("425.search.rna.fna", link=Link.OUTPUT, transfer=False)
-
-                searchJob.profile("globus", "maxwalltime", "120")
-                searchJob.profile("globus", "hostcount", "8")
-                searchJob.profile("globus", "count", "8")
-                dax.addJob(searchJob)
-		dax.depends(searchJob, preprocessJob)
+		if "annotate-sims-aa" in run:
+			annotatesims1Job = Job("wrapper-annotate-sims", node_label="wrapper-annotate-sims")
+			self.use_reference_dbs(annotatesims1Job, ["m5nr_v1.bdb"])
+			annotatesims1Job.addArguments("-input=%s650.superblat.sims" % ns["blat-prot"])
+			annotatesims1Job.addArguments("-out_prefix=%s650" % ns["annotate-sims-aa"])
+			annotatesims1Job.addArguments("-aa")
+			annotatesims1Job.addArguments("-ach_ver=%s" % self.ach_annotation_ver)
+			annotatesims1Job.addArguments("-ann_file=m5nr_v1.bdb")
+
+			self.uses(annotatesims1Job, "%s650.superblat.sims" % ns["blat-prot"], link=Link.INPUT)
+			self.uses(annotatesims1Job, "%s650.aa.sims.filter" % ns["annotate-sims-aa"], link=Link.OUTPUT, transfer=False)
+			self.uses(annotatesims1Job, "%s650.aa.expand.protein" % ns["annotate-sims-aa"], link=Link.OUTPUT, transfer=False)
+			self.uses(annotatesims1Job, "%s650.aa.expand.lca" % ns["annotate-sims-aa"], link=Link.OUTPUT, transfer=False)
+			self.uses(annotatesims1Job, "%s650.aa.expand.ontology" % ns["annotate-sims-aa"], link=Link.OUTPUT, transfer=False)
+
+			self.resources(annotatesims1Job, size, walltime=720, stage="wrapper-annotate-sims-aa")
+			dax.addJob(annotatesims1Job)
+			self.depends(annotatesims1Job, blatprotJob)
+
+		# Search RNA Job(s)
+		if "search-rna" in run:
+			if chunks > 1:
+				splitJob, inputs = self.split_fasta(dax, "%s100.preprocess.passed.fna" % ns["preprocess"], chunks, size,
+					"%s100.preprocess.passed.fna" % ns["search-rna"])
+				self.depends(splitJob, preprocessJob)
+				outputs = [self.part_name("%s425.search.rna.fna" % ns["search-rna"], i) for i in range(chunks)]
+			else:
+				inputs = ["%s100.preprocess.passed.fna" % ns["preprocess"]]
+				outputs = ["%s425.search.rna.fna" % ns["search-rna"]]
+
+			searchJobs = []
+			for i in range(chunks):
+				searchJob = Job("wrapper-search-rna", node_label="wrapper-search-rna")
+				res = self.resources(searchJob, size // chunks, walltime=120, count=8)
+				self.use_reference_dbs(searchJob, [self.m5rna_clust])
+				searchJob.addArguments("-input=%s" % inputs[i])
+				searchJob.addArguments("-output=%s" % outputs[i])
+				searchJob.addArguments("-rna_nr=%s" % self.m5rna_clust)
+				searchJob.addArguments("-size=100")
+				searchJob.addArguments("-proc=%d" % res.count)
+
+				self.uses(searchJob, inputs[i], link=Link.INPUT)
+				self.uses(searchJob, outputs[i], link=Link.OUTPUT, transfer=False)
+
+				dax.addJob(searchJob)
+				if chunks > 1:
+					self.depends(searchJob, splitJob)
+				else:
+					self.depends(searchJob, preprocessJob)
+				searchJobs.append(searchJob)
+
+			if chunks > 1:
+				searchJob = self.merge_files(dax, [("%s425.search.rna.fna" % ns["search-rna"], outputs)], size)
+				for job in searchJobs:
+					self.depends(searchJob, job)
+			self.cache_outputs(dax, searchJob, ns, keys, "search-rna", size)
 
 		# CLuster (Search RNA) Job
-		cluster2Job = Job("wrapper-cluster", node_label="wrapper-cluster")
-                cluster2Job.addArguments("-input=425.search.rna.fna")
-                cluster2Job.addArguments("-out_prefix=440.cluster")
-                cluster2Job.addArguments("-rna")
-                cluster2Job.addArguments("-pid=%s" % self.rna_pid)
-                cluster2Job.addArguments("-memory=20")
-
-                cluster2Job.uses("425.search.rna.fna", link=Link.INPUT)
-                cluster2Job.uses("440.cluster.rna%s.fna" % self.rna_pid, link=Link.OUTPUT, transfer=False)
-                cluster2Job.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.OUTPUT, transfer=False)
-
-                cluster2Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(cluster2Job)
-		dax.depends(cluster2Job, searchJob)
+		if "cluster-rna" in run:
+			cluster2Job = Job("wrapper-cluster", node_label="wrapper-cluster")
+			res = self.resources(cluster2Job, size, walltime=30, memory=20, stage="wrapper-cluster-rna")
+			cluster2Job.addArguments("-input=%s425.search.rna.fna" % ns["search-rna"])
+			cluster2Job.addArguments("-out_prefix=%s440.cluster" % ns["cluster-rna"])
+			cluster2Job.addArguments("-rna")
+			cluster2Job.addArguments("-pid=%s" % self.rna_pid)
+			cluster2Job.addArguments("-memory=%d" % res.memory)
+
+			self.uses(cluster2Job, "%s425.search.rna.fna" % ns["search-rna"], link=Link.INPUT)
+			self.uses(cluster2Job, "%s440.cluster.rna%s.fna" % (ns["cluster-rna"], self.rna_pid), link=Link.OUTPUT, transfer=False)
+			self.uses(cluster2Job, "%s440.cluster.rna%s.mapping" % (ns["cluster-rna"], self.rna_pid), link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(cluster2Job)
+			self.depends(cluster2Job, searchJob)
+			self.cache_outputs(dax, cluster2Job, ns, keys, "cluster-rna", size)
 
 		# Blat_rna Job
-		blatrnaJob = Job("wrapper-blat-rna", node_label="wrapper-blat-rna")
-		blatrnaJob.addArguments("--input=440.cluster.rna%s.fna" % self.rna_pid)
-		blatrnaJob.addArguments("-rna_nr=m5rna")
-		blatrnaJob.addArguments("--output=450.rna.sims")
-		blatrnaJob.addArguments("-assembled=%s" % self.assembled)
-
-		blatrnaJob.uses("440.cluster.rna%s.fna" % self.rna_pid, link=Link.INPUT)
-		blatrnaJob.uses("450.rna.sims", link=Link.OUTPUT, transfer=False)
-		
-		blatrnaJob.profile("globus", "maxwalltime", "20")
-		dax.addJob(blatrnaJob)
-		dax.depends(blatrnaJob, cluster2Job)
+		if "blat-rna" in run:
+			blatrnaJob = Job("wrapper-blat-rna", node_label="wrapper-blat-rna")
+			self.use_reference_dbs(blatrnaJob, ["m5rna"])
+			blatrnaJob.addArguments("--input=%s440.cluster.rna%s.fna" % (ns["cluster-rna"], self.rna_pid))
+			blatrnaJob.addArguments("-rna_nr=m5rna")
+			blatrnaJob.addArguments("--output=%s450.rna.sims" % ns["blat-rna"])
+			blatrnaJob.addArguments("-assembled=%s" % self.assembled)
+
+			self.uses(blatrnaJob, "%s440.cluster.rna%s.fna" % (ns["cluster-rna"], self.rna_pid), link=Link.INPUT)
+			self.uses(blatrnaJob, "%s450.rna.sims" % ns["blat-rna"], link=Link.OUTPUT, transfer=False)
+
+			self.resources(blatrnaJob, size, walltime=20)
+			dax.addJob(blatrnaJob)
+			self.depends(blatrnaJob, cluster2Job)
+			self.cache_outputs(dax, blatrnaJob, ns, keys, "blat-rna", size)
 
 		# Annotate Sims (Blat RNA) Job
-		annotatesims2Job = Job("wrapper-annotate-sims", node_label="wrapper-annotate-sims")
-		annotatesims2Job.addArguments("-input=450.rna.sims")
-		annotatesims2Job.addArguments("-out_prefix=450")
-		annotatesims2Job.addArguments("-rna")
-		annotatesims2Job.addArguments("-ach_ver=%s" % self.ach_annotation_ver)
-		annotatesims2Job.addArguments("-ann_file=m5nr_v1.bdb")
-
-		annotatesims2Job.uses("450.rna.sims", link=Link.INPUT)
-		annotatesims2Job.uses("450.rna.sims.filter", link=Link.OUTPUT, transfer=False)
-		annotatesims2Job.uses("450.rna.expand.rna", link=Link.OUTPUT, transfer=False)
-		annotatesims2Job.uses("450.rna.expand.lca", link=Link.OUTPUT, transfer=False)
-
-		annotatesims2Job.profile("globus", "maxwalltime", "30")
-		dax.addJob(annotatesims2Job)
-		dax.depends(annotatesims2Job, blatrnaJob)
+		if "annotate-sims-rna" in run:
+			annotatesims2Job = Job("wrapper-annotate-sims", node_label="wrapper-annotate-sims")
+			self.use_reference_dbs(annotatesims2Job, ["m5nr_v1.bdb"])
+			annotatesims2Job.addArguments("-input=%s450.rna.sims" % ns["blat-rna"])
+			annotatesims2Job.addArguments("-out_prefix=%s450" % ns["annotate-sims-rna"])
+			annotatesims2Job.addArguments("-rna")
+			annotatesims2Job.addArguments("-ach_ver=%s" % self.ach_annotation_ver)
+			annotatesims2Job.addArguments("-ann_file=m5nr_v1.bdb")
+
+			self.uses(annotatesims2Job, "%s450.rna.sims" % ns["blat-rna"], link=Link.INPUT)
+			self.uses(annotatesims2Job, "%s450.rna.sims.filter" % ns["annotate-sims-rna"], link=Link.OUTPUT, transfer=False)
+			self.uses(annotatesims2Job, "%s450.rna.expand.rna" % ns["annotate-sims-rna"], link=Link.OUTPUT, transfer=False)
+			self.uses(annotatesims2Job, "%s450.rna.expand.lca" % ns["annotate-sims-rna"], link=Link.OUTPUT, transfer=False)
+
+			self.resources(annotatesims2Job, size, walltime=30, stage="wrapper-annotate-sims-rna")
+			dax.addJob(annotatesims2Job)
+			self.depends(annotatesims2Job, blatrnaJob)
 
 		# Index Sim Seq Job
-		indexJob = Job("wrapper-index", node_label="wrapper-index")
-		indexJob.addArguments("-in_seqs=350.genecalling.coding.fna")
-		indexJob.addArguments("-in_seqs=425.search.rna.fna")
-		indexJob.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		indexJob.addArguments("-in_maps=440.cluster.rna%s.mapping" % self.rna_pid)
-		indexJob.addArguments("-in_sims=650.aa.sims.filter")
-		indexJob.addArguments("-in_sims=450.rna.sims.filter")
-		indexJob.addArguments("-output=700.annotation.sims.filter.seq")
-		indexJob.addArguments("-ach_ver=%s" % self.ach_annotation_ver)
-		indexJob.addArguments("-memory=10")
-		indexJob.addArguments("-ann_file=m5nr_v1.bdb")
-
-		indexJob.uses("350.genecalling.coding.fna", link=Link.INPUT)
-		indexJob.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		indexJob.uses("650.aa.sims.filter", link=Link.INPUT)
-		indexJob.uses("425.search.rna.fna", link=Link.INPUT)
-		indexJob.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.INPUT)
-		indexJob.uses("450.rna.sims.filter", link=Link.INPUT)
-		indexJob.uses("700.annotation.sims.filter.seq", link=Link.OUTPUT, transfer=False)
-		indexJob.uses("700.annotation.sims.filter.seq.index", link=Link.OUTPUT, transfer=False)
-
-		indexJob.profile("globus", "maxwalltime", "120")
-                dax.addJob(indexJob)
-                dax.depends(indexJob, geneJob)
-                dax.depends(indexJob, cluster1Job)
-                dax.depends(indexJob, cluster2Job)
-                dax.depends(indexJob, searchJob)
-                dax.depends(indexJob, annotatesims1Job)
-
-		# Annotate Summary Job (13)
-		summary13Job = Job("wrapper-summary", node_label="wrapper-summary")
-		summary13Job.addArguments("-job=1")
-		summary13Job.addArguments("-in_expand=650.aa.expand.protein")
-		summary13Job.addArguments("-in_expand=450.rna.expand.rna")
-		summary13Job.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		summary13Job.addArguments("-in_maps=440.cluster.rna%s.mapping" % self.rna_pid)
-		summary13Job.addArguments("-in_assemb=075.assembly.coverage")
-		summary13Job.addArguments("-in_index=700.annotation.sims.filter.seq.index")
-		summary13Job.addArguments("-output=700.annotation.md5.summary")
-		summary13Job.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
-		summary13Job.addArguments("-type=md5")
-
-		summary13Job.uses("075.assembly.coverage", link=Link.INPUT)
-		summary13Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		summary13Job.uses("650.aa.expand.protein", link=Link.INPUT)
-		summary13Job.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.INPUT)
-		summary13Job.uses("450.rna.expand.rna", link=Link.INPUT)
-		summary13Job.uses("700.annotation.sims.filter.seq.index", link=Link.INPUT)
-		summary13Job.uses("700.annotation.md5.summary", link=Link.OUTPUT, transfer=True)
-
-		summary13Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(summary13Job)
-                dax.depends(summary13Job, qcJob)
-                dax.depends(summary13Job, cluster1Job)
-                dax.depends(summary13Job, cluster2Job)
-                dax.depends(summary13Job, indexJob)
-                dax.depends(summary13Job, annotatesims1Job)
-                dax.depends(summary13Job, annotatesims2Job)
-
-		# Annotate Summary Job (14)
-		summary14Job = Job("wrapper-summary", node_label="wrapper-summary")
-		summary14Job.addArguments("-job=1")
-		summary14Job.addArguments("-in_expand=650.aa.expand.protein")
-		summary14Job.addArguments("-in_expand=450.rna.expand.rna")
-		summary14Job.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		summary14Job.addArguments("-in_maps=440.cluster.rna%s.mapping" % self.rna_pid)
-		summary14Job.addArguments("-in_assemb=075.assembly.coverage")
-		summary14Job.addArguments("-output=700.annotation.function.summary")
-		summary14Job.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
-		summary14Job.addArguments("-type=function")
-
-		summary14Job.uses("075.assembly.coverage", link=Link.INPUT)
-		summary14Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		summary14Job.uses("650.aa.expand.protein", link=Link.INPUT)
-		summary14Job.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.INPUT)
-		summary14Job.uses("450.rna.expand.rna", link=Link.INPUT)
-		summary14Job.uses("700.annotation.function.summary", link=Link.OUTPUT, transfer=True)
-
-		summary14Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(summary14Job)
-                dax.depends(summary14Job, qcJob)
-                dax.depends(summary14Job, cluster1Job)
-                dax.depends(summary14Job, cluster2Job)
-                dax.depends(summary14Job, annotatesims1Job)
-                dax.depends(summary14Job, annotatesims2Job)
-
-		# Annotate Summary Job (15)
-		summary15Job = Job("wrapper-summary", node_label="wrapper-summary")
-		summary15Job.addArguments("-job=1")
-		summary15Job.addArguments("-in_expand=650.aa.expand.protein")
-		summary15Job.addArguments("-in_expand=450.rna.expand.rna")
-		summary15Job.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		summary15Job.addArguments("-in_maps=440.cluster.rna%s.mapping" % self.rna_pid)
-		summary15Job.addArguments("-in_assemb=075.assembly.coverage")
-		summary15Job.addArguments("-output=700.annotation.organism.summary")
-		summary15Job.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
-		summary15Job.addArguments("-type=organism")
-
-		summary15Job.uses("075.assembly.coverage", link=Link.INPUT)
-		summary15Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		summary15Job.uses("650.aa.expand.protein", link=Link.INPUT)
-		summary15Job.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.INPUT)
-		summary15Job.uses("450.rna.expand.rna", link=Link.INPUT)
-		summary15Job.uses("700.annotation.organism.summary", link=Link.OUTPUT, transfer=True)
-
-		summary15Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(summary15Job)
-                dax.depends(summary15Job, qcJob)
-                dax.depends(summary15Job, cluster1Job)
-                dax.depends(summary15Job, cluster2Job)
-                dax.depends(summary15Job, annotatesims1Job)
-                dax.depends(summary15Job, annotatesims2Job)
-
-		# Annotate Summary Job (16)
-		summary16Job = Job("wrapper-summary", node_label="wrapper-summary")
-		summary16Job.addArguments("-job=1")
-		summary16Job.addArguments("-in_expand=650.aa.expand.lca")
-		summary16Job.addArguments("-in_expand=450.rna.expand.lca")
-		summary16Job.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		summary16Job.addArguments("-in_maps=440.cluster.rna%s.mapping" % self.rna_pid)
-		summary16Job.addArguments("-in_assemb=075.assembly.coverage")
-		summary16Job.addArguments("-output=700.annotation.lca.summary")
-		summary16Job.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
-		summary16Job.addArguments("-type=lca")
-
-		summary16Job.uses("075.assembly.coverage", link=Link.INPUT)
-		summary16Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		summary16Job.uses("650.aa.expand.lca", link=Link.INPUT)
-		summary16Job.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.INPUT)
-		summary16Job.uses("450.rna.expand.lca", link=Link.INPUT)
-		summary16Job.uses("700.annotation.lca.summary", link=Link.OUTPUT, transfer=True)
-
-		summary16Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(summary16Job)
-                dax.depends(summary16Job, qcJob)
-                dax.depends(summary16Job, cluster1Job)
-                dax.depends(summary16Job, cluster2Job)
-                dax.depends(summary16Job, annotatesims1Job)
-                dax.depends(summary16Job, annotatesims2Job)
-
-		# Annotate Summary Job (17)
-		summary17Job = Job("wrapper-summary", node_label="wrapper-summary")
-		summary17Job.addArguments("-job=1")
-		summary17Job.addArguments("-in_expand=650.aa.expand.ontology")
-		summary17Job.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		summary17Job.addArguments("-in_assemb=075.assembly.coverage")
-		summary17Job.addArguments("-output=700.annotation.ontology.summary")
-		summary17Job.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
-		summary17Job.addArguments("-type=ontology")
-
-		summary17Job.uses("075.assembly.coverage", link=Link.INPUT)
-		summary17Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		summary17Job.uses("650.aa.expand.ontology", link=Link.INPUT)
-		summary17Job.uses("700.annotation.ontology.summary", link=Link.OUTPUT, transfer=True)
-
-		summary17Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(summary17Job)
-                dax.depends(summary17Job, qcJob)
-                dax.depends(summary17Job, cluster1Job)
-                dax.depends(summary17Job, annotatesims1Job)
-
-		# Annotate Summary Job (18)
-		summary18Job = Job("wrapper-summary", node_label="wrapper-summary")
-		summary18Job.addArguments("-job=1")
-		summary18Job.addArguments("-in_expand=650.aa.expand.protein")
-		summary18Job.addArguments("-in_expand=450.rna.expand.rna")
-		summary18Job.addArguments("-in_maps=550.cluster.aa%s.mapping" % self.aa_pid)
-		summary18Job.addArguments("-in_maps=440.cluster.rna%s.mapping" % self.rna_pid)
-		summary18Job.addArguments("-in_assemb=075.assembly.coverage")
-		summary18Job.addArguments("-output=700.annotation.source.stats")
-		summary18Job.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
-		summary18Job.addArguments("-type=source")
-
-		summary18Job.uses("075.assembly.coverage", link=Link.INPUT)
-		summary18Job.uses("550.cluster.aa%s.mapping" % self.aa_pid, link=Link.INPUT)
-		summary18Job.uses("650.aa.expand.protein", link=Link.INPUT)
-		summary18Job.uses("440.cluster.rna%s.mapping" % self.rna_pid, link=Link.INPUT)
-		summary18Job.uses("450.rna.expand.rna", link=Link.INPUT)
-		summary18Job.uses("700.annotation.source.stats", link=Link.OUTPUT, transfer=True)
-
-		summary18Job.profile("globus", "maxwalltime", "30")
-                dax.addJob(summary18Job)
-                dax.depends(summary18Job, qcJob)
-                dax.depends(summary18Job, cluster1Job)
-                dax.depends(summary18Job, cluster2Job)
-                dax.depends(summary18Job, annotatesims1Job)
-                dax.depends(summary18Job, annotatesims2Job)
-
-	
+		if "index" in run:
+			indexJob = Job("wrapper-index", node_label="wrapper-index")
+			res = self.resources(indexJob, size, walltime=120, memory=10)
+			self.use_reference_dbs(indexJob, ["m5nr_v1.bdb"])
+			indexJob.addArguments("-in_seqs=%s350.genecalling.coding.fna" % ns["genecalling"])
+			indexJob.addArguments("-in_seqs=%s425.search.rna.fna" % ns["search-rna"])
+			indexJob.addArguments("-in_maps=%s550.cluster.aa%s.mapping" % (ns["cluster-aa"], self.aa_pid))
+			indexJob.addArguments("-in_maps=%s440.cluster.rna%s.mapping" % (ns["cluster-rna"], self.rna_pid))
+			indexJob.addArguments("-in_sims=%s650.aa.sims.filter" % ns["annotate-sims-aa"])
+			indexJob.addArguments("-in_sims=%s450.rna.sims.filter" % ns["annotate-sims-rna"])
+			indexJob.addArguments("-output=%s700.annotation.sims.filter.seq" % ns["index"])
+			indexJob.addArguments("-ach_ver=%s" % self.ach_annotation_ver)
+			indexJob.addArguments("-memory=%d" % res.memory)
+			indexJob.addArguments("-ann_file=m5nr_v1.bdb")
+
+			self.uses(indexJob, "%s350.genecalling.coding.fna" % ns["genecalling"], link=Link.INPUT)
+			self.uses(indexJob, "%s550.cluster.aa%s.mapping" % (ns["cluster-aa"], self.aa_pid), link=Link.INPUT)
+			self.uses(indexJob, "%s650.aa.sims.filter" % ns["annotate-sims-aa"], link=Link.INPUT)
+			self.uses(indexJob, "%s425.search.rna.fna" % ns["search-rna"], link=Link.INPUT)
+			self.uses(indexJob, "%s440.cluster.rna%s.mapping" % (ns["cluster-rna"], self.rna_pid), link=Link.INPUT)
+			self.uses(indexJob, "%s450.rna.sims.filter" % ns["annotate-sims-rna"], link=Link.INPUT)
+			self.uses(indexJob, "%s700.annotation.sims.filter.seq" % ns["index"], link=Link.OUTPUT, transfer=False)
+			self.uses(indexJob, "%s700.annotation.sims.filter.seq.index" % ns["index"], link=Link.OUTPUT, transfer=False)
+
+			dax.addJob(indexJob)
+			self.depends(indexJob, geneJob)
+			self.depends(indexJob, cluster1Job)
+			self.depends(indexJob, cluster2Job)
+			self.depends(indexJob, searchJob)
+			self.depends(indexJob, annotatesims1Job)
+
+		# Annotate Summary Job(s)
+		# By default a single job builds every summary from one copy of the inputs; with
+		# combined_summary = 0 each summary type gets its own job
+		if "summary" in run:
+			summaryJobs = []
+			if self.combined_summary:
+				groups = [SUMMARIES]
+			else:
+				groups = [[summary] for summary in SUMMARIES]
+
+			for summaries in groups:
+				summaryJob = Job("wrapper-summary", node_label="wrapper-summary")
+				summaryJob.addArguments("-job=1")
+				summaryJob.addArguments("-in_assemb=%s075.assembly.coverage" % ns["qc"])
+				summaryJob.addArguments("-nr_ver=%s" % self.ach_annotation_ver)
+
+				inputs = ["%s075.assembly.coverage" % ns["qc"]]
+				parents = [qcJob, cluster1Job, annotatesims1Job]
+				for summaryType, output, aaExpand, rnaExpand in summaries:
+					summaryJob.addArguments("-type=%s" % summaryType)
+					summaryJob.addArguments("-output=%s%s" % (ns["summary"], output))
+					summaryJob.addArguments("-in_expand=%s%s" % (ns["annotate-sims-aa"], aaExpand))
+					summaryJob.addArguments("-in_maps=%s550.cluster.aa%s.mapping" % (ns["cluster-aa"], self.aa_pid))
+					inputs += [ns["annotate-sims-aa"] + aaExpand, "%s550.cluster.aa%s.mapping" % (ns["cluster-aa"], self.aa_pid)]
+					if rnaExpand is not None:
+						summaryJob.addArguments("-in_expand=%s%s" % (ns["annotate-sims-rna"], rnaExpand))
+						summaryJob.addArguments("-in_maps=%s440.cluster.rna%s.mapping" % (ns["cluster-rna"], self.rna_pid))
+						inputs += [ns["annotate-sims-rna"] + rnaExpand, "%s440.cluster.rna%s.mapping" % (ns["cluster-rna"], self.rna_pid)]
+						parents += [cluster2Job, annotatesims2Job]
+					if summaryType == "md5":
+						summaryJob.addArguments("-in_index=%s700.annotation.sims.filter.seq.index" % ns["index"])
+						inputs.append("%s700.annotation.sims.filter.seq.index" % ns["index"])
+						parents.append(indexJob)
+
+				for lfn in unique(inputs):
+					self.uses(summaryJob, lfn, link=Link.INPUT)
+				for summaryType, output, aaExpand, rnaExpand in summaries:
+					self.uses(summaryJob, ns["summary"] + output, link=Link.OUTPUT, transfer=True)
+
+				if len(summaries) > 1:
+					self.resources(summaryJob, size, walltime=30, count=len(summaries), stage="wrapper-summary-combined")
+				else:
+					self.resources(summaryJob, size, walltime=30)
+				dax.addJob(summaryJob)
+				self.depends(summaryJob, *unique(parents))
+				summaryJobs.append(summaryJob)
+
+			# The store is named after the sample and the swept settings of its summaries
+			if self.summary_db:
+				store = "%s700.annotation.db" % ns["summary"]
+				sample = ("%s.%s" % (name or sample_name(mgfile), self.stage_namespaces("", variant)["summary"])).rstrip(".")
+				storeJob = Job("wrapper-summary-db", node_label="wrapper-summary-db")
+				storeJob.addArguments(store, sample)
+				for summaryType, output, aaExpand, rnaExpand in SUMMARIES:
+					storeJob.addArguments("%s=%s%s" % (summaryType, ns["summary"], output))
+					self.uses(storeJob, ns["summary"] + output, link=Link.INPUT)
+				self.uses(storeJob, store, link=Link.OUTPUT, transfer=True)
+
+				self.resources(storeJob, size, walltime=30)
+				dax.addJob(storeJob)
+				self.depends(storeJob, *summaryJobs)
+				self.summary_stores.append((storeJob, store, size))
+
+	def merge_summary_stores(self, dax):
+		"Add a job that merges the summary stores of all samples and sweep variants into 700.annotation.db"
+		mergeJob = Job("wrapper-merge-summary-db", node_label="wrapper-merge-summary-db")
+		mergeJob.addArguments("700.annotation.db")
+		for storeJob, store, size in self.summary_stores:
+			mergeJob.addArguments(store)
+			self.uses(mergeJob, store, link=Link.INPUT)
+		self.uses(mergeJob, "700.annotation.db", link=Link.OUTPUT, transfer=True)
+
+		self.resources(mergeJob, sum(size for storeJob, store, size in self.summary_stores), walltime=30)
+		dax.addJob(mergeJob)
+		self.depends(mergeJob, *[storeJob for storeJob, store, size in self.summary_stores])
+
+	def generate_workflow(self):
+		"Generate a workflow (DAX, config files, and replica catalog)"
+		if len(self.stats) == 0:
+			self.profile_inputs()
+
+		ts = datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+		dax = ADAG("mgrast-prod-%s" % ts)
+
+		for name, mgfile in self.samples:
+			for variant in self.variants:
+				self.add_pipeline(dax, name, mgfile, variant)
+		if len(self.summary_stores) > 1:
+			self.merge_summary_stores(dax)
+
+		self.generate_compression_profiles()
+		self.generate_telemetry_profiles()
+		path, makespan = self.generate_dependencies(dax)
+		self.generate_clusters()
+
 		# Write the DAX file
 		dax.writeXMLFile(self.daxfile)
 
 		# Generate the replica catalog
 		self.generate_replica_catalog()
 
+		# Record the input size of every job for the resource model
+		self.generate_job_sizes()
+
+		# Record the statistics of the metagenomes
+		self.generate_input_stats()
+
+		print("Critical path (predicted makespan %d min):" % makespan)
+		for job in path:
+			print("  %-30s %s %6d min" % (job.name, job.id, self.graph.runtimes[id(job)]))
+
+
+	def generate_preview(self):
+		"Write a preview workflow to the preview directory in 'outdir' if preview_reads or preview_percent is set. It runs the pipeline on a sample of the reads of every metagenome, with smaller jobs and a higher priority, so that approximate summaries are ready long before those of the full workflow. Returns the preview workflow, or None"
+		if self.preview_reads <= 0 and self.preview_percent <= 0:
+			return None
+		previewdir = os.path.join(self.outdir, "preview")
+		os.makedirs(previewdir)
+
+		# The sampled files and their names are prefixed with "preview", so that the
+		# outputs of the two workflows can share an output directory
+		samples = []
+		scales = {}
+		for name, mgfile in self.samples:
+			reads = self.stats[mgfile]["reads"]
+			if self.preview_reads > 0:
+				n = self.preview_reads
+			else:
+				n = int(round(reads * self.preview_percent / 100.0))
+			n = max(1, min(n, reads))
+
+			previewname = "preview.%s" % name if name else "preview"
+			previewfile = os.path.join(previewdir, "%s.%s" % (name or sample_name(mgfile), self.file_format.lower()))
+			f = open(previewfile, "wb")
+			try:
+				subsample(mgfile, f, n, self.preview_sampling, reads)
+			finally:
+				f.close()
+			samples.append((previewname, previewfile))
+			scales[previewfile] = float(n) / reads
+
+		preview = MGRASTWorkflow(previewdir, self.config, samples, scales)
+		preview.profile_inputs()
+		print("Preview workflow in %s:" % previewdir)
+		preview.generate_workflow()
+		return preview
+
+
+def sample_name(path):
+	"Return the name of the sample in the metagenome file 'path': its base name without sequence file extensions"
+	name = os.path.basename(path)
+	for ext in (".gz", ".fastq", ".fq", ".fasta", ".fna", ".fa"):
+		if name.endswith(ext):
+			name = name[:-len(ext)]
+	return re.sub(r"[^A-Za-z0-9._-]", "_", name)
+
+def read_manifest(path):
+	"Read a batch manifest. Each line holds the path of a metagenome file, optionally preceded by a sample name. Returns a list of (name, path) pairs"
+	samples = []
+	base = os.path.dirname(os.path.abspath(path))
+	f = open(path, "r")
+	try:
+		for line in f:
+			line = line.strip()
+			if line == "" or line.startswith("#"):
+				continue
+			fields = line.split()
+			if len(fields) == 1:
+				mgfile = fields[0]
+				name = sample_name(mgfile)
+			elif len(fields) == 2:
+				name, mgfile = fields
+			else:
+				raise Exception("Invalid manifest line: %s" % line)
+			samples.append((name, os.path.join(base, mgfile)))
+	finally:
+		f.close()
+	return samples
+
+def find_samples(paths):
+	"Return the (name, path) pairs for the metagenome files and directories of metagenome files in 'paths'"
+	samples = []
+	for path in paths:
+		if os.path.isdir(path):
+			for entry in sorted(os.listdir(path)):
+				mgfile = os.path.join(path, entry)
+				if not entry.startswith(".") and os.path.isfile(mgfile):
+					samples.append((sample_name(mgfile), mgfile))
+		else:
+			samples.append((sample_name(path), path))
+	return samples
 
 def main():
-	if len(sys.argv) < 4:
-		raise Exception("Usage: %s CONFIGFILE OUTDIR METAGENOMEFILE" % sys.argv[0])
+	parser = OptionParser(usage="%prog [options] CONFIGFILE OUTDIR [METAGENOME...]",
+		description="Generate an MG-RAST workflow in OUTDIR. A single METAGENOME file gives the classic one-sample "
+		"workflow; several files, directories of files or a manifest give one batch workflow with a namespaced "
+		"sub-pipeline per sample.")
+	parser.add_option("-m", "--manifest", dest="manifest", metavar="FILE",
+		help="Batch manifest with one metagenome per line, as 'PATH' or 'NAME PATH'")
+	options, args = parser.parse_args()
 
-	configfile = sys.argv[1]
-	outdir = sys.argv[2]
-	mgfile = sys.argv[3]
+	if len(args) < 2 or (len(args) < 3 and options.manifest is None):
+		parser.error("CONFIGFILE, OUTDIR and at least one METAGENOME or a --manifest are required")
+
+	configfile = args[0]
+	outdir = args[1]
+	mgpaths = args[2:]
 
 	if not os.path.isfile(configfile):
 		raise Exception("No such file: %s" % configfile)
 	if os.path.isdir(outdir):
 		raise Exception("Directory exists: %s" % outdir)
-        if not os.path.isfile(mgfile):
-                raise Exception("No such file: %s" % mgfile)
-
-	# Create the output directory
-	outdir = os.path.abspath(outdir)
-	os.makedirs(outdir)
+	if options.manifest is not None and not os.path.isfile(options.manifest):
+		raise Exception("No such file: %s" % options.manifest)
+
+	# A single metagenome file keeps the original, un-namespaced file names
+	if options.manifest is None and len(mgpaths) == 1 and not os.path.isdir(mgpaths[0]):
+		samples = [(None, mgpaths[0])]
+	else:
+		samples = find_samples(mgpaths)
+		if options.manifest is not None:
+			samples += read_manifest(options.manifest)
+		if len(samples) == 0:
+			raise Exception("No metagenome files found")
+
+	names = set()
+	for name, mgfile in samples:
+		if not os.path.isfile(mgfile):
+			raise Exception("No such file: %s" % mgfile)
+		if name in names:
+			raise Exception("Duplicate sample name: %s" % name)
+		names.add(name)
 
 	# Read the config file
 	config = ConfigParser()
 	config.read(configfile)
 
-	 # Generate the workflow in outdir based on the config file
-	workflow = MGRASTWorkflow(outdir, config, mgfile)
+	# Scan the metagenomes before anything is written, so that bad inputs fail early
+	outdir = os.path.abspath(outdir)
+	workflow = MGRASTWorkflow(outdir, config, samples)
+	workflow.profile_inputs()
+
+	# Create the output directory
+	os.makedirs(outdir)
+
+	# Generate the workflow in outdir based on the config file
 	workflow.generate_workflow()
+	workflow.generate_preview()
 
 
 if __name__ == '__main__':
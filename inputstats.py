@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+import sys
+import os
+import gzip
+import mmap
+import bisect
+import json
+from collections import Counter
+
+# The input is scanned in blocks of this many bytes
+BLOCK_SIZE = 64 * 1024 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+# The first byte of a record in each supported format
+FORMATS = {b">": "fasta", b"@": "fastq"}
+
+
+def is_gzip(path):
+	f = open(path, "rb")
+	try:
+		return f.read(2) == GZIP_MAGIC
+	finally:
+		f.close()
+
+def read_blocks(path):
+	"Yield the (decompressed) contents of 'path' in blocks of BLOCK_SIZE bytes. Plain files are memory-mapped"
+	if is_gzip(path):
+		f = gzip.open(path, "rb")
+		try:
+			while True:
+				block = f.read(BLOCK_SIZE)
+				if not block:
+					break
+				yield block
+		finally:
+			f.close()
+		return
+
+	size = os.path.getsize(path)
+	if size == 0:
+		return
+	f = open(path, "rb")
+	try:
+		m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		try:
+			for offset in range(0, size, BLOCK_SIZE):
+				yield m[offset:offset + BLOCK_SIZE]
+		finally:
+			m.close()
+	finally:
+		f.close()
+
+def fasta_sequences(blocks):
+	"Yield lists of the sequences of whole FASTA records read from 'blocks', one list per block, without line breaks"
+	carry = b""
+	for block in blocks:
+		data = carry + block
+		cut = data.rfind(b"\n>")
+		if cut < 0:
+			carry = data
+			continue
+		carry = data[cut + 1:]
+		yield fasta_records(data[:cut])
+	if carry.strip():
+		yield fasta_records(carry.rstrip(b"\r\n"))
+
+def fasta_records(data):
+	"Return the sequences of the FASTA records in 'data'. If every record is a header and one sequence line, the lines are split at buffer level; otherwise the records are split one by one"
+	lines = data.split(b"\n")
+	if len(lines) % 2 == 0 and b"\r" not in data:
+		# Every other line is a header if all of them start with ">" and hold every ">" of the data
+		headers = b"\n" + b"\n".join(lines[0::2])
+		if headers.count(b"\n>") == len(lines) // 2 and headers.count(b">") == data.count(b">"):
+			return lines[1::2]
+	return [r.split(b"\n", 1)[1].replace(b"\n", b"").replace(b"\r", b"") if b"\n" in r else b"" for r in data.split(b"\n>")]
+
+def fastq_sequences(blocks):
+	"Yield lists of the sequences of whole FASTQ records read from 'blocks', one list per block"
+	carry = b""
+	for block in blocks:
+		lines = (carry + block).split(b"\n")
+		last = lines.pop()
+		n = len(lines) - len(lines) % 4
+		carry = b"\n".join(lines[n:] + [last])
+		yield fastq_records(lines[1:n:4], block)
+	lines = carry.split(b"\n")
+	if lines and not lines[-1]:
+		lines.pop()
+	if lines:
+		if len(lines) % 4 != 0:
+			raise Exception("Truncated FASTQ record at end of input")
+		yield fastq_records(lines[1::4], carry)
+
+def fastq_records(seqs, data):
+	"Return the sequence lines 'seqs' of FASTQ records read from 'data', without carriage returns"
+	if b"\r" in data:
+		return [s.rstrip(b"\r") for s in seqs]
+	return seqs
+
+def count_lengths(lengths, seqs):
+	"Add the lengths of 'seqs' to the Counter 'lengths'. The lengths are sorted, so that only the distinct lengths are counted one by one"
+	sizes = sorted(map(len, seqs))
+	start = 0
+	while start < len(sizes):
+		end = bisect.bisect_right(sizes, sizes[start], start)
+		lengths[sizes[start]] += end - start
+		start = end
+
+def profile(path):
+	"Scan the metagenome 'path' and return a dict of its format, read count, base count, read length distribution and GC content"
+	first = b""
+	for block in read_blocks(path):
+		first = block.lstrip()[:1]
+		break
+	if first not in FORMATS:
+		if first:
+			raise Exception("%s is neither FASTA nor FASTQ" % path)
+		raise Exception("%s contains no reads" % path)
+	fmt = FORMATS[first]
+
+	reads = bases = gc = ambiguous = 0
+	lengths = Counter()
+
+	# Total bytes read, which is the uncompressed size for gzip input
+	total = [0]
+	def counted(blocks):
+		for block in blocks:
+			total[0] += len(block)
+			yield block
+
+	if fmt == "fasta":
+		batches = fasta_sequences(counted(read_blocks(path)))
+	else:
+		batches = fastq_sequences(counted(read_blocks(path)))
+
+	for seqs in batches:
+		# Count bases over a whole block at once rather than read by read
+		data = b"".join(seqs).upper()
+		bases += len(data)
+		gc += data.count(b"G") + data.count(b"C")
+		ambiguous += data.count(b"N")
+		reads += len(seqs)
+		count_lengths(lengths, seqs)
+
+	if reads == 0:
+		raise Exception("%s contains no reads" % path)
+
+	return {
+		"format": fmt,
+		"compressed": is_gzip(path),
+		"file_size": os.path.getsize(path),
+		"size": total[0],
+		"reads": reads,
+		"bases": bases,
+		"gc_content": float(gc) / bases if bases else 0.0,
+		"ambiguous_bases": ambiguous,
+		"min_length": min(lengths),
+		"max_length": max(lengths),
+		"mean_length": float(bases) / reads,
+		"median_length": length_quantile(lengths, reads, 0.5),
+		"lengths": dict((str(k), v) for k, v in sorted(lengths.items()))
+	}
+
+def length_quantile(lengths, reads, q):
+	"Return the read length at quantile 'q' of the 'lengths' histogram"
+	seen = 0
+	for length in sorted(lengths):
+		seen += lengths[length]
+		if seen >= q * reads:
+			return length
+	return max(lengths)
+
+
+def main():
+	if len(sys.argv) < 2:
+		raise Exception("Usage: %s FILE..." % sys.argv[0])
+
+	stats = {}
+	for path in sys.argv[1:]:
+		if not os.path.isfile(path):
+			raise Exception("No such file: %s" % path)
+		stats[path] = profile(path)
+	json.dump(stats, sys.stdout, indent=2, sort_keys=True)
+	sys.stdout.write("\n")
+
+
+if __name__ == '__main__':
+	main()
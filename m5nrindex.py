@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+import sys
+import os
+import gzip
+import mmap
+import shutil
+import struct
+import binascii
+import tempfile
+import subprocess
+
+# An index of the M5NR annotation database, keyed by md5. The entries are sorted
+# by md5 and found by a binary search within the range of their first two bytes,
+# so a lookup touches a few pages of a memory-mapped file. Concurrent jobs on a
+# node share one copy of it in the page cache.
+#
+#   header     magic, database type, entry count, section offsets
+#   prefixes   65537 entry numbers: the entries starting with prefix p are
+#              prefixes[p] to prefixes[p + 1]
+#   entries    16-byte md5, offset and length of the annotation in data
+#   data       the annotations
+#   extras     entries whose key is not an md5, as key and value lengths
+#              followed by the key and the value
+MAGIC = "M5NRIDX1"
+HEADER = struct.Struct("<8sIQQQQ")
+PREFIXES = struct.Struct("<65537Q")
+ENTRY = struct.Struct("<16sQI")
+EXTRA = struct.Struct("<II")
+RECORD = struct.Struct("<16sI")
+
+# Keys that are not md5s are kept in memory, so only a few are allowed
+MAX_EXTRAS = 10000
+
+BLOCK_SIZE = 1 << 20
+
+
+def bsddb_module():
+	"Return the Berkeley DB module: bsddb in Python 2, or bsddb3"
+	try:
+		import bsddb
+	except ImportError:
+		try:
+			import bsddb3 as bsddb
+		except ImportError:
+			raise Exception("The bsddb or bsddb3 module is required to read and write Berkeley DB files")
+	return bsddb
+
+def open_bdb(path, flag, dbtype=None):
+	"Open the Berkeley DB 'path' with 'flag' as bsddb does. Returns the database and its type. The type of an existing database is detected"
+	bsddb = bsddb_module()
+	if dbtype is None:
+		d = bsddb.db.DB()
+		d.open(path, None, bsddb.db.DB_UNKNOWN, bsddb.db.DB_RDONLY)
+		dbtype = d.get_type()
+		d.close()
+	if dbtype == bsddb.db.DB_HASH:
+		return bsddb.hashopen(path, flag), dbtype
+	elif dbtype == bsddb.db.DB_BTREE:
+		return bsddb.btopen(path, flag), dbtype
+	raise Exception("Unsupported Berkeley DB type %d: %s" % (dbtype, path))
+
+def pack_md5(key):
+	"Return the 16 bytes of the hexadecimal md5 'key', or None if it is not one"
+	if len(key) != 32:
+		return None
+	try:
+		return binascii.unhexlify(key.lower())
+	except (TypeError, ValueError):
+		return None
+
+
+def build(source, path):
+	"Write the index of the annotation database 'source' to 'path'. Returns the number of md5 entries"
+	db, dbtype = open_bdb(source, "r")
+	tmpdir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+	try:
+		# The entries are spread over 256 buckets by their first byte, so each bucket
+		# can be sorted in memory
+		buckets = [open(os.path.join(tmpdir, "%02x" % i), "wb") for i in range(256)]
+		extras = []
+		count = 0
+		try:
+			for key, value in db.iteritems():
+				md5 = pack_md5(key)
+				if md5 is None:
+					extras.append((key, value))
+					if len(extras) > MAX_EXTRAS:
+						raise Exception("More than %d keys of %s are not md5s" % (MAX_EXTRAS, source))
+					continue
+				bucket = buckets[ord(md5[0])]
+				bucket.write(RECORD.pack(md5, len(value)))
+				bucket.write(value)
+				count += 1
+		finally:
+			for bucket in buckets:
+				bucket.close()
+			db.close()
+
+		entries_offset = HEADER.size + PREFIXES.size
+		data_offset = entries_offset + count * ENTRY.size
+		prefixes = [0] * 65537
+
+		out = open(path, "wb")
+		try:
+			out.truncate(data_offset)
+		finally:
+			out.close()
+
+		# Entries and annotations are written through two handles, one for each section
+		entries = open(path, "r+b")
+		data = open(path, "r+b")
+		try:
+			entries.seek(entries_offset)
+			data.seek(data_offset)
+			n = offset = 0
+			for i in range(256):
+				bucketfile = os.path.join(tmpdir, "%02x" % i)
+				f = open(bucketfile, "rb")
+				try:
+					records = []
+					while True:
+						header = f.read(RECORD.size)
+						if not header:
+							break
+						md5, length = RECORD.unpack(header)
+						records.append((md5, f.read(length)))
+				finally:
+					f.close()
+				os.remove(bucketfile)
+
+				records.sort()
+				for md5, value in records:
+					prefixes[struct.unpack(">H", md5[:2])[0] + 1] += 1
+					entries.write(ENTRY.pack(md5, offset, len(value)))
+					data.write(value)
+					offset += len(value)
+					n += 1
+
+			extras_offset = data_offset + offset
+			for key, value in extras:
+				data.write(EXTRA.pack(len(key), len(value)))
+				data.write(key)
+				data.write(value)
+
+			for p in range(65536):
+				prefixes[p + 1] += prefixes[p]
+			entries.seek(0)
+			entries.write(HEADER.pack(MAGIC, dbtype, count, entries_offset, data_offset, extras_offset))
+			entries.write(PREFIXES.pack(*prefixes))
+		finally:
+			entries.close()
+			data.close()
+	finally:
+		shutil.rmtree(tmpdir)
+	return count
+
+
+class AnnotationIndex(object):
+	"A memory-mapped index written by build()"
+
+	def __init__(self, path):
+		f = open(path, "rb")
+		try:
+			self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+		magic, self.dbtype, self.count, self.entries_offset, self.data_offset, self.extras_offset = HEADER.unpack_from(self.mm, 0)
+		if magic != MAGIC:
+			raise Exception("Not an annotation index: %s" % path)
+		self.prefixes = PREFIXES.unpack_from(self.mm, HEADER.size)
+
+		self.extras = {}
+		pos = self.extras_offset
+		while pos < len(self.mm):
+			klen, vlen = EXTRA.unpack_from(self.mm, pos)
+			pos += EXTRA.size
+			self.extras[self.mm[pos:pos + klen]] = self.mm[pos + klen:pos + klen + vlen]
+			pos += klen + vlen
+
+	def close(self):
+		self.mm.close()
+
+	def get(self, key):
+		"Return the annotation of 'key', or None if it is not in the index"
+		md5 = pack_md5(key)
+		if md5 is None:
+			return self.extras.get(key)
+		p = struct.unpack(">H", md5[:2])[0]
+		lo, hi = self.prefixes[p], self.prefixes[p + 1]
+		while lo < hi:
+			mid = (lo + hi) // 2
+			pos = self.entries_offset + mid * ENTRY.size
+			k = self.mm[pos:pos + 16]
+			if k < md5:
+				lo = mid + 1
+			elif k > md5:
+				hi = mid
+			else:
+				md5, offset, length = ENTRY.unpack_from(self.mm, pos)
+				return self.mm[self.data_offset + offset:self.data_offset + offset + length]
+		return None
+
+	def lookup(self, keys):
+		"Return the annotations of 'keys' that are in the index, keyed by key. The keys are looked up in order, so the pages of the index are visited once"
+		found = {}
+		for key in sorted(set(keys)):
+			value = self.get(key)
+			if value is not None:
+				found[key] = value
+		return found
+
+
+def open_input(path):
+	"Open 'path' for reading, or its compressed copy (.gz or .zst) if only that exists"
+	if os.path.exists(path):
+		return open(path, "r")
+	if os.path.exists(path + ".gz"):
+		return gzip.open(path + ".gz", "rb")
+	if os.path.exists(path + ".zst"):
+		return subprocess.Popen(["zstd", "-dc", "-q", path + ".zst"], stdout=subprocess.PIPE).stdout
+	raise Exception("No such file: %s" % path)
+
+def sims_md5s(paths):
+	"Return the md5s of the hits in the similarity files 'paths': their second column"
+	md5s = set()
+	for path in paths:
+		f = open_input(path)
+		try:
+			for line in f:
+				fields = line.split("\t", 2)
+				if len(fields) > 1:
+					md5s.add(fields[1])
+		finally:
+			f.close()
+	return md5s
+
+def subset(index, path, sims):
+	"Write the Berkeley DB 'path' with the annotations of the md5s in the similarity files 'sims', and the entries of the index that are not md5s. Returns the number of md5s found and the number looked up"
+	md5s = sims_md5s(sims)
+	found = index.lookup(md5s)
+	db, dbtype = open_bdb(path, "n", index.dbtype)
+	try:
+		for key, value in index.extras.items():
+			db[key] = value
+		for key in sorted(found):
+			db[key] = found[key]
+	finally:
+		db.close()
+	return len(found), len(md5s)
+
+
+def main():
+	if len(sys.argv) == 4 and sys.argv[1] == "build":
+		count = build(sys.argv[2], sys.argv[3])
+		print("%s: %d md5s" % (sys.argv[3], count))
+	elif len(sys.argv) >= 3 and sys.argv[1] == "lookup":
+		# md5s are read from standard input when none are given
+		index = AnnotationIndex(sys.argv[2])
+		keys = sys.argv[3:] or [line.strip() for line in sys.stdin if line.strip()]
+		found = index.lookup(keys)
+		for key in keys:
+			if key in found:
+				sys.stdout.write("%s\t%s\n" % (key, found[key]))
+	elif len(sys.argv) >= 5 and sys.argv[1] == "subset":
+		found, total = subset(AnnotationIndex(sys.argv[2]), sys.argv[3], sys.argv[4:])
+		print("%s: %d of %d md5s" % (sys.argv[3], found, total))
+	else:
+		raise Exception("Usage: %s build BDB INDEX | lookup INDEX [MD5...] | subset INDEX BDB SIMS..." % sys.argv[0])
+
+
+if __name__ == '__main__':
+	main()
@@ -7,6 +7,23 @@ SCRATCH_DIR=/scratch/scratchdirs/rfsilva
 OUTPUT_DIR=$MGRAST_DIR/outputs
 PEGASUS_HOME=/project/projectdirs/m2187/pegasus/pegasus-4.4.0
 PROJECT=m2187
+# Reference databases are staged here from MGRAST_DIR when a manifest is
+# configured. Each job stages them on the node where its command runs, so this
+# must be node-local storage (local disk, /tmp or a burst buffer), not a shared
+# file system. Jobs that cannot create it, or find no room in it for their
+# databases, read them from MGRAST_DIR instead
+REFDB_CACHE=${REFDB_CACHE:-/tmp/mgrast-refdb}
+# Annotation index built from m5nr_v1.bdb by m5nrindex.py. Used by the
+# annotate-sims and index jobs when it exists
+M5NR_INDEX=$MGRAST_DIR/predata/m5nr_v1.idx
+# The wrappers are staged, but they run telemetry.py, compression.sh, refdb.py
+# and m5nrindex.py from this checkout on the MOM and compute nodes, so it must
+# be on one of these file systems, which are mounted there
+SHARED_FS="/global /scratch /scratch2"
+# Runs the jobs of a cluster when daxgen.py is run with clustering set:
+# seqexec runs them one after another on the MOM node, where the wrappers can
+# start aprun; mpiexec runs them in parallel inside pegasus-mpi-cluster
+CLUSTER_AGGREGATOR=seqexec
 
 # General Configuration for NERSC sites
 SITE=hopper
@@ -31,6 +48,17 @@ else
 fi
 
 # Parsing Templates
+DIR=$(cd $(dirname $0) && pwd)
+shared=
+for fs in $SHARED_FS; do
+	case $(cd $DIR && pwd -P)/ in
+		$fs/*) shared=$fs ;;
+	esac
+done
+if [ -z "$shared" ]; then
+	echo "$DIR is not on a file system mounted on the compute nodes ($SHARED_FS)"
+	exit 1
+fi
 render_template() {
 	eval "echo \"$(cat $1)\""
 }
@@ -42,7 +70,6 @@ done
 
 
 # Workflow Setup
-DIR=$(cd $(dirname $0) && pwd)
 INPUT_DIR=$DIR/inputs
 SUBMIT_DIR=$WORKFLOW_DIR/submit
 DAX=$WORKFLOW_DIR/dax.xml
@@ -54,6 +81,14 @@ PP=$DIR/pegasus.properties
 render_template $RC.template > $RC
 render_template $DIR/sites.template > $SC
 
+# Job Clustering
+CLUSTER_PROPERTIES=
+CLUSTER_OPTIONS=
+if [ -f $WORKFLOW_DIR/clustering ]; then
+	CLUSTER_PROPERTIES=-Dpegasus.clusterer.job.aggregator=$CLUSTER_AGGREGATOR
+	CLUSTER_OPTIONS="--cluster $(cat $WORKFLOW_DIR/clustering)"
+fi
+
 # Generating Transformation Catalog
 echo "# MG-RAST Transformation Catalog" > $TC
 
@@ -78,6 +113,7 @@ pegasus-plan \
 	-Dpegasus.catalog.replica=File \
 	-Dpegasus.catalog.replica.file=$RC \
 	-Dpegasus.catalog.transformation.file=$TC \
+	$CLUSTER_PROPERTIES \
 	--conf $PP \
 	--dax $DAX \
 	--dir $SUBMIT_DIR \
@@ -85,4 +121,5 @@ pegasus-plan \
 	--sites $SITE \
 	--output-site $OUTPUT_SITE \
 	--cleanup leaf \
+	$CLUSTER_OPTIONS \
 	--force
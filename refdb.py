@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import sys
+import os
+import json
+import fcntl
+import fnmatch
+import hashlib
+
+from cache import BLOCK_SIZE, file_digest
+
+
+def database_files(root, name, patterns):
+	"Return the files in 'root' that belong to the reference database 'name': those matching one of 'patterns', file names or shell patterns. Every pattern has to match a file"
+	available = sorted(f for f in os.listdir(root) if os.path.isfile(os.path.join(root, f)))
+	files = []
+	for pattern in patterns:
+		matches = fnmatch.filter(available, pattern)
+		if len(matches) == 0:
+			raise Exception("No file %s for reference database %s in %s" % (pattern, name, root))
+		files += [f for f in matches if f not in files]
+	return files
+
+def parse_database(arg):
+	"Parse a database given as NAME=FILE,FILE... into its name and file patterns. A bare NAME is the single file NAME"
+	if "=" not in arg:
+		return arg, [arg]
+	name, patterns = arg.split("=", 1)
+	return name, [p for p in patterns.split(",") if p]
+
+def build_manifest(root, databases):
+	"Return a manifest of the reference 'databases' in the directory 'root', a list of (name, file patterns) pairs, with the size and SHA-1 digest of every file"
+	root = os.path.abspath(root)
+	manifest = {}
+	for name, patterns in databases:
+		files = database_files(root, name, patterns)
+		manifest[name] = {"root": root, "files": {}}
+		for filename in files:
+			path = os.path.join(root, filename)
+			manifest[name]["files"][filename] = {"size": os.path.getsize(path), "sha1": file_digest(path)}
+	return manifest
+
+def read_manifest(path):
+	f = open(path, "r")
+	try:
+		return json.load(f)
+	finally:
+		f.close()
+
+def write_manifest(path, databases):
+	f = open(path, "w")
+	try:
+		json.dump(databases, f, indent=2, sort_keys=True)
+	finally:
+		f.close()
+
+
+def copy_file(src, dest):
+	"Copy 'src' to 'dest' and return the SHA-1 digest of the data copied"
+	h = hashlib.sha1()
+	fin = open(src, "rb")
+	try:
+		fout = open(dest, "wb")
+		try:
+			while True:
+				block = fin.read(BLOCK_SIZE)
+				if not block:
+					break
+				h.update(block)
+				fout.write(block)
+		finally:
+			fout.close()
+	finally:
+		fin.close()
+	return h.hexdigest()
+
+def stage_file(root, filename, meta, cachedir):
+	"Make sure 'cachedir' holds a verified copy of 'filename' from 'root'. Only one process per node copies a file; the others wait for it and reuse the copy"
+	dest = os.path.join(cachedir, filename)
+	marker = dest + ".sha1"
+
+	lock = open(os.path.join(cachedir, ".%s.lock" % filename), "a")
+	try:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+
+		# A copy is only trusted once its digest has been checked and recorded
+		if os.path.isfile(dest) and os.path.isfile(marker) and os.path.getsize(dest) == meta["size"]:
+			f = open(marker, "r")
+			try:
+				if f.read().strip() == meta["sha1"]:
+					return
+			finally:
+				f.close()
+
+		if os.path.isfile(marker):
+			os.unlink(marker)
+		src = os.path.join(root, filename)
+		if os.path.getsize(src) != meta["size"]:
+			raise Exception("%s does not match the manifest: size %d, expected %d" % (src, os.path.getsize(src), meta["size"]))
+
+		tmp = "%s.tmp.%d" % (dest, os.getpid())
+		digest = copy_file(src, tmp)
+		if digest != meta["sha1"]:
+			os.unlink(tmp)
+			raise Exception("%s does not match the manifest: SHA-1 %s, expected %s" % (src, digest, meta["sha1"]))
+		os.rename(tmp, dest)
+
+		f = open(marker, "w")
+		try:
+			f.write(digest + "\n")
+		finally:
+			f.close()
+	finally:
+		lock.close()
+
+def missing_bytes(files, cachedir):
+	"Return the number of bytes of 'files' (a manifest's files) that still have to be copied into 'cachedir'"
+	total = 0
+	for filename, meta in files.items():
+		dest = os.path.join(cachedir, filename)
+		if not (os.path.isfile(dest) and os.path.getsize(dest) == meta["size"]):
+			total += meta["size"]
+	return total
+
+def stage(manifest, cachebase, names):
+	"Copy the reference databases 'names' listed in 'manifest' into the node-local cache under 'cachebase'. Returns the directory that holds them. If the cache cannot be created or has no room for the databases, they are read in place and their source directory is returned"
+	root = None
+	files = {}
+	for name in names:
+		if name not in manifest:
+			raise Exception("Reference database %s is not in the manifest" % name)
+		db = manifest[name]
+		if root is None:
+			root = db["root"]
+		elif root != db["root"]:
+			raise Exception("Reference databases %s come from more than one directory" % " ".join(names))
+		files.update(db["files"])
+
+	# Databases are cached per source directory, so a staged directory can stand in for it
+	cachedir = os.path.join(cachebase, hashlib.sha1(root.encode("utf-8")).hexdigest()[:16])
+	try:
+		if not os.path.isdir(cachedir):
+			os.makedirs(cachedir)
+	except OSError:
+		if not os.path.isdir(cachedir):
+			sys.stderr.write("WARNING: Cannot create %s, reading the reference databases from %s\n" % (cachedir, root))
+			return root
+	st = os.statvfs(cachedir)
+	if missing_bytes(files, cachedir) > st.f_bavail * st.f_frsize:
+		sys.stderr.write("WARNING: No room for %s in %s, reading them from %s\n" % (" ".join(names), cachedir, root))
+		return root
+
+	for filename, meta in sorted(files.items()):
+		stage_file(root, filename, meta, cachedir)
+	return cachedir
+
+
+def main():
+	if len(sys.argv) >= 5 and sys.argv[1] == "manifest":
+		# Databases from several directories are collected by running this once per directory
+		path = sys.argv[2]
+		databases = {}
+		if os.path.isfile(path):
+			databases = read_manifest(path)
+		databases.update(build_manifest(sys.argv[3], [parse_database(arg) for arg in sys.argv[4:]]))
+		write_manifest(path, databases)
+	elif len(sys.argv) >= 5 and sys.argv[1] == "stage":
+		print(stage(read_manifest(sys.argv[2]), sys.argv[3], sys.argv[4:]))
+	else:
+		raise Exception("Usage: %s manifest MANIFEST ROOT NAME[=FILE,...]... | stage MANIFEST CACHE_DIR NAME..." % sys.argv[0])
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+import sys
+import os
+import re
+import math
+import json
+from collections import namedtuple
+from xml.etree import ElementTree
+
+# Walltime, cores and memory for a job. Walltime is in minutes, memory in GB
+Resources = namedtuple("Resources", "walltime count memory")
+
+# One finished job: its stage (transformation), the bytes of metagenome it
+# processed, wall and CPU seconds, peak RSS in KB, and the cores it was given.
+# CPU time and peak RSS are None unless telemetry.py measured them where the
+# command ran: for the wrappers that use aprun, kickstart only sees the launcher
+# on the MOM node
+Record = namedtuple("Record", "stage size runtime cputime maxrss count")
+
+# Stages need this many successful runs before their estimates are used
+MIN_RECORDS = 3
+
+# Estimates are padded by these factors, because a job that hits its walltime
+# costs far more than one that waits a little longer in the queue
+WALLTIME_MARGIN = 1.5
+MEMORY_MARGIN = 1.25
+
+MIN_WALLTIME = 5
+MAX_WALLTIME = 2880
+
+# Kickstart writes <jobname>.out.NNN, and Pegasus names jobs <transformation>_<DAX job id>
+KICKSTART_FILE = re.compile(r"^(?P<name>.+)_(?P<id>ID\d+)\.out(\.\d+)?$")
+
+
+def linear_fit(xs, ys):
+	"Least squares fit of y = a + b*x. Returns (a, b). Falls back to the mean of 'ys' when 'xs' do not vary or the slope is negative"
+	n = len(xs)
+	mx = sum(xs) / float(n)
+	my = sum(ys) / float(n)
+	sxx = sum((x - mx) ** 2 for x in xs)
+	if sxx == 0:
+		return my, 0.0
+	b = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+	if b < 0:
+		return my, 0.0
+	return my - b * mx, b
+
+
+class ResourceModel(object):
+	"Per-stage runtime, core and memory models fitted against input size"
+
+	def __init__(self, stages=None):
+		"'stages' maps a stage name to its fitted model, as written by save()"
+		self.stages = stages or {}
+
+	@classmethod
+	def load(cls, path):
+		"Read a model written by save()"
+		f = open(path, "r")
+		try:
+			return cls(json.load(f))
+		finally:
+			f.close()
+
+	def save(self, path):
+		"Write the model to 'path' as JSON"
+		f = open(path, "w")
+		try:
+			json.dump(self.stages, f, indent=2, sort_keys=True)
+		finally:
+			f.close()
+
+	def fit(self, records):
+		"Fit a model for every stage that has at least MIN_RECORDS records. The runtime is fitted as core seconds (the wall seconds times the cores kept busy), so that the walltime follows the core count. Cores and memory are only fitted from records with telemetry"
+		bystage = {}
+		for r in records:
+			bystage.setdefault(r.stage, []).append(r)
+
+		for stage, rs in bystage.items():
+			if len(rs) < MIN_RECORDS:
+				continue
+			work = []
+			for r in rs:
+				used = r.count or 1
+				if r.cputime is not None:
+					used = min(used, r.cputime / max(r.runtime, 1.0))
+				work.append(r.runtime * used)
+			self.stages[stage] = {
+				"records": len(rs),
+				"work": linear_fit([r.size for r in rs], work)
+			}
+
+			measured = [r for r in rs if r.cputime is not None]
+			if len(measured) >= MIN_RECORDS:
+				sizes = [r.size for r in measured]
+				self.stages[stage]["maxrss"] = linear_fit(sizes, [r.maxrss for r in measured])
+				self.stages[stage]["cores"] = sum(r.cputime / max(r.runtime, 1.0) for r in measured) / len(measured)
+
+	def estimate(self, stage, size, default):
+		"Return the Resources for a job of 'stage' on 'size' bytes of input. Any value the model cannot estimate is taken from 'default'"
+		model = self.stages.get(stage)
+		if model is None or "work" not in model:
+			return default
+
+		# Never ask for more cores than the stage is configured for, only for
+		# as many as it was able to keep busy
+		count = default.count
+		if count is not None and "cores" in model:
+			count = max(1, min(count, int(math.ceil(model["cores"]))))
+
+		# The work is spread over the cores the job gets, as far as the stage
+		# keeps them busy
+		used = count or 1
+		if "cores" in model:
+			used = min(used, model["cores"])
+		a, b = model["work"]
+		seconds = (a + b * size) / used * WALLTIME_MARGIN if used > 0 else 0.0
+		walltime = int(math.ceil(seconds / 60.0))
+		walltime = max(MIN_WALLTIME, min(walltime, MAX_WALLTIME))
+
+		memory = default.memory
+		if memory is not None and "maxrss" in model:
+			a, b = model["maxrss"]
+			kb = (a + b * size) * MEMORY_MARGIN
+			memory = max(1, int(math.ceil(kb / (1024.0 * 1024.0))))
+
+		return Resources(walltime, count, memory)
+
+
+def strip_namespace(tag):
+	return tag.split("}", 1)[-1]
+
+def read_invocations(path):
+	"Yield (duration, cputime, maxrss) for every successful invocation in the kickstart file 'path'"
+	f = open(path, "r")
+	try:
+		data = f.read()
+	finally:
+		f.close()
+
+	# Retried and clustered jobs append several XML documents to one file
+	for doc in data.split("<?xml")[1:]:
+		try:
+			root = ElementTree.fromstring("<?xml" + doc)
+		except ElementTree.ParseError:
+			continue
+		if strip_namespace(root.tag) != "invocation":
+			continue
+		mainjob = status = usage = None
+		for e in root:
+			if strip_namespace(e.tag) == "mainjob":
+				mainjob = e
+		if mainjob is None:
+			continue
+		for e in mainjob:
+			tag = strip_namespace(e.tag)
+			if tag == "usage":
+				usage = e
+			elif tag == "status":
+				status = e
+		if usage is None or status is None or status.get("raw") != "0":
+			continue
+		cputime = float(usage.get("utime", 0)) + float(usage.get("stime", 0))
+		yield float(mainjob.get("duration", root.get("duration", 0))), cputime, float(usage.get("maxrss", 0))
+
+def read_workflow(wfdir):
+	"Return the Records of a workflow directory generated by daxgen.py and run from its submit directory. Jobs with a telemetry record are taken from it; the others only from their kickstart records, without CPU time and peak RSS"
+	path = os.path.join(wfdir, "jobs.json")
+	if not os.path.isfile(path):
+		raise Exception("No such file: %s" % path)
+	f = open(path, "r")
+	try:
+		jobs = json.load(f)
+	finally:
+		f.close()
+
+	# telemetry.py imports this module
+	import telemetry
+	records = []
+	measured = set()
+	for record in telemetry.read_workflow(wfdir):
+		if record["status"] != 0:
+			continue
+		job = jobs[record["job"]]
+		records.append(Record(job["stage"], job["input_size"], record["walltime"], record["utime"] + record["stime"],
+			record["maxrss"], job.get("count")))
+		measured.add(record["job"])
+
+	for dirpath, dirnames, filenames in os.walk(os.path.join(wfdir, "submit")):
+		for filename in filenames:
+			m = KICKSTART_FILE.match(filename)
+			if m is None or m.group("id") not in jobs or m.group("id") in measured:
+				continue
+			job = jobs[m.group("id")]
+			for runtime, cputime, maxrss in read_invocations(os.path.join(dirpath, filename)):
+				records.append(Record(job["stage"], job["input_size"], runtime, None, None, job.get("count")))
+	return records
+
+
+def main():
+	if len(sys.argv) < 3:
+		raise Exception("Usage: %s MODELFILE WORKFLOW_DIR..." % sys.argv[0])
+
+	modelfile = sys.argv[1]
+	records = []
+	for wfdir in sys.argv[2:]:
+		if not os.path.isdir(wfdir):
+			raise Exception("No such directory: %s" % wfdir)
+		records += read_workflow(wfdir)
+
+	model = ResourceModel()
+	model.fit(records)
+	model.save(modelfile)
+
+	for stage in sorted(model.stages):
+		m = model.stages[stage]
+		cores = "%.1f cores" % m["cores"] if "cores" in m else "cores not measured"
+		print("%-30s %5d runs  %10.1f + %.3g/byte core seconds  %s" % (stage, m["records"], m["work"][0], m["work"][1], cores))
+
+
+if __name__ == '__main__':
+	main()
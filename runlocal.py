@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+import sys
+import os
+import re
+import shutil
+import subprocess
+import multiprocessing
+from optparse import OptionParser
+from xml.etree import ElementTree
+
+# Finished jobs are recorded here, in the work directory, so a restarted run skips them
+STATE_FILE = "runlocal.done"
+
+
+def strip_namespace(tag):
+	return tag.split("}", 1)[-1]
+
+class LocalJob(object):
+	"A job of the DAX: its transformation, arguments, profiles and files"
+
+	def __init__(self, element):
+		self.id = element.get("id")
+		self.name = element.get("name")
+		self.arguments = []
+		self.env = {}
+		self.count = 1
+		self.priority = 0
+		self.inputs = []
+		self.outputs = []
+		self.parents = set()
+		for e in element:
+			tag = strip_namespace(e.tag)
+			if tag == "argument":
+				self.arguments = "".join(e.itertext()).split()
+			elif tag == "profile":
+				ns, key, value = e.get("namespace"), e.get("key"), (e.text or "").strip()
+				if ns == "env":
+					self.env[key] = value
+				elif ns == "globus" and key == "count":
+					self.count = int(value)
+				elif ns == "condor" and key == "priority":
+					self.priority = int(value)
+			elif tag == "uses":
+				name = e.get("name") or e.get("file")
+				if e.get("link") == "output":
+					self.outputs.append((name, e.get("transfer") == "true"))
+				else:
+					self.inputs.append(name)
+
+def read_dax(path):
+	"Return the jobs of the DAX 'path', keyed by job ID, with their parents"
+	root = ElementTree.parse(path).getroot()
+	jobs = {}
+	for e in root:
+		if strip_namespace(e.tag) == "job":
+			job = LocalJob(e)
+			jobs[job.id] = job
+	for e in root:
+		if strip_namespace(e.tag) == "child":
+			for p in e:
+				jobs[e.get("ref")].parents.add(p.get("ref"))
+	return jobs
+
+def read_replicas(path):
+	"Return the paths of the files in the replica catalog 'path', keyed by LFN. The host of gsiftp:// URLs is dropped, so they must point to local paths"
+	replicas = {}
+	f = open(path, "r")
+	try:
+		for line in f:
+			fields = line.split()
+			if len(fields) < 2:
+				continue
+			url = fields[1]
+			m = re.match(r"^(file|gsiftp)://[^/]*(/.*)$", url)
+			if m is None:
+				raise Exception("Unsupported replica URL: %s" % url)
+			replicas[fields[0]] = os.path.normpath(m.group(2))
+	finally:
+		f.close()
+	return replicas
+
+
+class LocalRunner(object):
+	"Runs the jobs of a DAX on this machine, in dependency order, with as many running at once as the cores allow. Every job reserves the cores of its count profile"
+
+	def __init__(self, jobs, replicas, bindir, workdir, outdir, cores):
+		self.jobs = jobs
+		self.replicas = replicas
+		self.bindir = bindir
+		self.workdir = workdir
+		self.outdir = outdir
+		self.cores = cores
+		self.statefile = os.path.join(workdir, STATE_FILE)
+		self.done = set()
+		if os.path.isfile(self.statefile):
+			f = open(self.statefile, "r")
+			try:
+				self.done = set(line.strip() for line in f if line.strip())
+			finally:
+				f.close()
+
+	def stage_inputs(self):
+		"Link the workflow inputs that no job produces into the work directory"
+		produced = set(name for job in self.jobs.values() for name, transfer in job.outputs)
+		for job in self.jobs.values():
+			for name in job.inputs:
+				if name in produced or os.path.isabs(name):
+					continue
+				dest = os.path.join(self.workdir, name)
+				if os.path.lexists(dest):
+					continue
+				if name not in self.replicas:
+					raise Exception("No replica for input %s of %s" % (name, job.id))
+				os.symlink(self.replicas[name], dest)
+
+	def start(self, job):
+		executable = os.path.join(self.bindir, job.name + ".sh")
+		if not os.path.isfile(executable):
+			executable = os.path.join(self.bindir, job.name)
+		env = dict(os.environ)
+		env.update(job.env)
+		log = open(os.path.join(self.workdir, "%s_%s.out" % (job.name, job.id)), "w")
+		try:
+			return subprocess.Popen(["/bin/bash", executable] + job.arguments, cwd=self.workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+		finally:
+			log.close()
+
+	def finish(self, job):
+		"Copy the outputs of 'job' that go to the output site, and record it as done"
+		for name, transfer in job.outputs:
+			if transfer:
+				shutil.copyfile(os.path.join(self.workdir, name), os.path.join(self.outdir, name))
+		f = open(self.statefile, "a")
+		try:
+			f.write(job.id + "\n")
+		finally:
+			f.close()
+		self.done.add(job.id)
+
+	def run(self):
+		"Run every job that has not finished yet. Returns True if all of them succeed"
+		self.stage_inputs()
+
+		pending = set(jid for jid in self.jobs if jid not in self.done)
+		running = {}
+		free = self.cores
+		failed = []
+		while pending or running:
+			# Start the ready jobs with the longest remaining path (highest priority) first,
+			# as long as their cores are free. Nothing new starts after a failure
+			if not failed:
+				ready = [self.jobs[jid] for jid in pending if self.jobs[jid].parents <= self.done]
+				ready.sort(key=lambda job: (-job.priority, job.id))
+				for job in ready:
+					count = min(job.count, self.cores)
+					if count > free:
+						continue
+					print("Starting %s %s on %d cores" % (job.id, job.name, count))
+					proc = self.start(job)
+					running[proc.pid] = (job, proc, count)
+					pending.discard(job.id)
+					free -= count
+			if not running:
+				break
+
+			pid, status = os.waitpid(-1, 0)
+			if pid not in running:
+				continue
+			job, proc, count = running.pop(pid)
+			proc.returncode = status
+			free += count
+			if status == 0:
+				self.finish(job)
+				print("Finished %s %s" % (job.id, job.name))
+			else:
+				failed.append(job)
+				print("FAILED %s %s, see %s_%s.out" % (job.id, job.name, job.name, job.id))
+
+		return not failed and not pending
+
+
+def main():
+	parser = OptionParser(usage="%prog [options] WORKFLOW_DIR BIN_DIR WORK_DIR OUTPUT_DIR",
+		description="Run a workflow generated by daxgen.py on this machine. BIN_DIR holds the wrappers rendered "
+		"from templates/local, and the replica catalog is read from WORKFLOW_DIR/rc. Jobs that finished in an earlier "
+		"run in WORK_DIR are skipped.")
+	parser.add_option("-j", "--cores", dest="cores", type="int", default=0,
+		help="Number of cores to use (default: all)")
+	options, args = parser.parse_args()
+
+	if len(args) != 4:
+		parser.error("WORKFLOW_DIR, BIN_DIR, WORK_DIR and OUTPUT_DIR are required")
+	wfdir, bindir, workdir, outdir = [os.path.abspath(a) for a in args]
+
+	for path in (os.path.join(wfdir, "dax.xml"), os.path.join(wfdir, "rc")):
+		if not os.path.isfile(path):
+			raise Exception("No such file: %s" % path)
+	for path in (workdir, outdir):
+		if not os.path.isdir(path):
+			os.makedirs(path)
+
+	cores = options.cores
+	if cores <= 0:
+		cores = multiprocessing.cpu_count()
+
+	jobs = read_dax(os.path.join(wfdir, "dax.xml"))
+	replicas = read_replicas(os.path.join(wfdir, "rc"))
+	runner = LocalRunner(jobs, replicas, bindir, workdir, outdir, cores)
+	if not runner.run():
+		sys.exit(1)
+
+
+if __name__ == '__main__':
+	main()
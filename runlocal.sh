@@ -0,0 +1,59 @@
+#!/bin/bash
+
+# User's Configuration, which can also be given in the environment
+MGRAST_DIR=${MGRAST_DIR:-/opt/mgrast}
+PIPELINE_DIR=${PIPELINE_DIR:-$MGRAST_DIR/pipeline}
+REFDB_CACHE=${REFDB_CACHE:-/tmp/mgrast-refdb}
+M5NR_INDEX=${M5NR_INDEX:-$MGRAST_DIR/predata/m5nr_v1.idx}
+# Number of cores to use, 0 for all of them
+CORES=${CORES:-0}
+
+# General Configuration for local runs
+SITE=local
+SITE_URL=localhost
+
+
+# Usage
+if [ $# -ne 1 ]; then
+	echo "Usage: $0 WORKFLOW_DIR"
+	exit 1
+fi
+
+# Verifying workflow directory
+WORKFLOW_DIR=$1
+if [ -d "$WORKFLOW_DIR" ]; then
+	WORKFLOW_DIR=$(cd $WORKFLOW_DIR && pwd)
+else
+	echo "No such directory: $WORKFLOW_DIR"
+	exit 1
+fi
+
+# Parsing Templates
+DIR=$(cd $(dirname $0) && pwd)
+render_template() {
+	eval "echo \"$(cat $1)\""
+}
+
+BIN_DIR=$WORKFLOW_DIR/bin
+mkdir -p $BIN_DIR
+for template in `ls $DIR/templates/$SITE`; do
+	render_template $DIR/templates/$SITE/$template > $BIN_DIR/${template%.template}
+	chmod +x $BIN_DIR/${template%.template}
+done
+
+
+# Workflow Setup
+WORK_DIR=$WORKFLOW_DIR/work
+OUTPUT_DIR=$WORKFLOW_DIR/outputs
+RC=$WORKFLOW_DIR/rc
+
+render_template $RC.template > $RC
+
+
+echo "Running workflow..."
+python $DIR/runlocal.py \
+	--cores $CORES \
+	$WORKFLOW_DIR \
+	$BIN_DIR \
+	$WORK_DIR \
+	$OUTPUT_DIR
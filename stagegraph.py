@@ -0,0 +1,163 @@
+class StageGraph(object):
+	"The jobs of a workflow and the dependencies between them. Dependencies come from explicit edges and from the files jobs write and read; the graph reduces them to their transitive reduction and finds the critical path from the estimated runtime of each job"
+
+	def __init__(self):
+		self.nodes = []
+		self.runtimes = {}
+		self.parents = {}
+		self.edge_set = set()
+		self.producers = {}
+		self.inputs = []
+
+	def add_job(self, job, runtime=0):
+		"Add 'job', which is estimated to run for 'runtime' minutes. Adding a job again updates its runtime"
+		if id(job) not in self.parents:
+			self.nodes.append(job)
+			self.parents[id(job)] = []
+		self.runtimes[id(job)] = runtime or self.runtimes.get(id(job), 0)
+
+	def add_edge(self, parent, child):
+		"Make 'child' run after 'parent'"
+		if parent is child:
+			return
+		self.add_job(parent)
+		self.add_job(child)
+		if (id(parent), id(child)) not in self.edge_set:
+			self.edge_set.add((id(parent), id(child)))
+			self.parents[id(child)].append(parent)
+
+	def add_use(self, job, name, output):
+		"Record that 'job' writes (if 'output') or reads the file 'name'. Readers run after the job that writes the file"
+		self.add_job(job)
+		if output:
+			if self.producers.get(name, job) is not job:
+				raise Exception("%s is written by more than one job" % name)
+			self.producers[name] = job
+		else:
+			self.inputs.append((job, name))
+
+	def edges(self):
+		"Return the (parent, child) edges of the graph, explicit and from data flow, in the order the jobs were added"
+		for job, name in self.inputs:
+			if name in self.producers:
+				self.add_edge(self.producers[name], job)
+		self.inputs = []
+		return [(parent, child) for child in self.nodes for parent in self.parents[id(child)]]
+
+	def children(self):
+		result = dict((id(job), []) for job in self.nodes)
+		for parent, child in self.edges():
+			result[id(parent)].append(child)
+		return result
+
+	def topological_order(self):
+		"Return the jobs with every job after all of its parents"
+		children = self.children()
+		indegree = dict((id(job), len(self.parents[id(job)])) for job in self.nodes)
+		order = [job for job in self.nodes if indegree[id(job)] == 0]
+		for job in order:
+			for child in children[id(job)]:
+				indegree[id(child)] -= 1
+				if indegree[id(child)] == 0:
+					order.append(child)
+		if len(order) != len(self.nodes):
+			raise Exception("The workflow has a dependency cycle")
+		return order
+
+	def reduced_edges(self):
+		"Return the edges of the transitive reduction of the graph: the edges that are not implied by a longer path"
+		order = self.topological_order()
+		index = dict((id(job), i) for i, job in enumerate(order))
+		children = self.children()
+
+		# A child of a job is implied if another child reaches it. Such paths only pass
+		# through jobs before the child in topological order, so each search stops at
+		# the last child and stays within the pipeline of the job
+		edges = []
+		for parent in order:
+			kids = sorted(children[id(parent)], key=lambda job: index[id(job)])
+			if len(kids) < 2:
+				edges += [(parent, child) for child in kids]
+				continue
+			last = index[id(kids[-1])]
+			reached = set()
+			for child in kids:
+				if id(child) in reached:
+					continue
+				edges.append((parent, child))
+				stack = [child]
+				while stack:
+					job = stack.pop()
+					for other in children[id(job)]:
+						if id(other) not in reached and index[id(other)] <= last:
+							reached.add(id(other))
+							stack.append(other)
+		return edges
+
+	def bottom_levels(self):
+		"Return the length in minutes of the longest path from every job to the end of the workflow, including the job itself, keyed by id(job)"
+		children = self.children()
+		levels = {}
+		for job in reversed(self.topological_order()):
+			longest = max([levels[id(child)] for child in children[id(job)]] or [0])
+			levels[id(job)] = self.runtimes[id(job)] + longest
+		return levels
+
+	def critical_path(self):
+		"Return the jobs on the longest path through the workflow, and its length in minutes, which is the predicted makespan with unlimited resources"
+		if len(self.nodes) == 0:
+			return [], 0
+		levels = self.bottom_levels()
+		children = self.children()
+		job = max([job for job in self.nodes if len(self.parents[id(job)]) == 0], key=lambda j: levels[id(j)])
+		path = [job]
+		while children[id(job)]:
+			job = max(children[id(job)], key=lambda j: levels[id(j)])
+			path.append(job)
+		return path, levels[id(path[0])]
+
+	def reaches(self, sources, target, index, children):
+		"Return True if a path leads from one of 'sources' to 'target'. Only jobs before 'target' in the topological order 'index' are searched"
+		limit = index[id(target)]
+		seen = set(id(job) for job in sources)
+		stack = list(sources)
+		while stack:
+			job = stack.pop()
+			for child in children[id(job)]:
+				if child is target:
+					return True
+				if id(child) not in seen and index[id(child)] < limit:
+					seen.add(id(child))
+					stack.append(child)
+		return False
+
+	def convex_groups(self, members):
+		"Partition 'members', a list of jobs, into groups that can each run as one job: every group is connected, and no path between two jobs of a group leaves the group, so merging a group cannot create a cycle. Returns the groups with more than one job"
+		order = self.topological_order()
+		index = dict((id(job), i) for i, job in enumerate(order))
+		children = self.children()
+
+		selected = set(id(job) for job in members)
+		group_of = {}
+		groups = []
+		for job in order:
+			if id(job) not in selected:
+				continue
+
+			# Join the group of a parent if no path from that group reaches this job through
+			# a job outside of it. Such a path ends with a parent outside of the group, and
+			# the group is convex, so it leaves the group by a child of a member
+			for parent in self.parents[id(job)]:
+				g = group_of.get(id(parent))
+				if g is None:
+					continue
+				outside = [child for member in groups[g] for child in children[id(member)]
+					if child is not job and group_of.get(id(child)) != g]
+				if not self.reaches(outside, job, index, children):
+					groups[g].append(job)
+					group_of[id(job)] = g
+					break
+			else:
+				group_of[id(job)] = len(groups)
+				groups.append([job])
+		return [g for g in groups if len(g) > 1]
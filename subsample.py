@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import os
+import gzip
+import random
+from optparse import OptionParser
+from inputstats import read_blocks, FORMATS
+
+METHODS = ["stride", "reservoir"]
+
+
+def file_format(path):
+	"Return the format of the metagenome 'path', fasta or fastq"
+	for block in read_blocks(path):
+		first = block.lstrip()[:1]
+		if first in FORMATS:
+			return FORMATS[first]
+		break
+	raise Exception("%s is neither FASTA nor FASTQ" % path)
+
+def fasta_records(blocks):
+	"Yield the whole FASTA records read from 'blocks', each ending with a newline"
+	carry = b""
+	for block in blocks:
+		data = carry + block
+		cut = data.rfind(b"\n>")
+		if cut < 0:
+			carry = data
+			continue
+		carry = data[cut + 1:]
+		parts = data[:cut].split(b"\n>")
+		yield parts[0].lstrip() + b"\n"
+		for part in parts[1:]:
+			yield b">" + part + b"\n"
+	if carry.strip():
+		yield carry.lstrip().rstrip(b"\n") + b"\n"
+
+def fastq_records(blocks):
+	"Yield the whole FASTQ records read from 'blocks', each ending with a newline"
+	carry = b""
+	for block in blocks:
+		lines = (carry + block).split(b"\n")
+		last = lines.pop()
+		n = len(lines) - len(lines) % 4
+		carry = b"\n".join(lines[n:] + [last])
+		for i in range(0, n, 4):
+			yield b"\n".join(lines[i:i + 4]) + b"\n"
+	lines = carry.split(b"\n")
+	if lines and not lines[-1]:
+		lines.pop()
+	if len(lines) % 4 != 0:
+		raise Exception("Truncated FASTQ record at end of input")
+	for i in range(0, len(lines), 4):
+		yield b"\n".join(lines[i:i + 4]) + b"\n"
+
+def records(path):
+	"Yield the records of the metagenome 'path' (plain or gzip-compressed)"
+	if file_format(path) == "fasta":
+		return fasta_records(read_blocks(path))
+	return fastq_records(read_blocks(path))
+
+
+def stride_sample(recs, total, n):
+	"Yield 'n' of the 'total' records 'recs', spread evenly over them"
+	for i, rec in enumerate(recs):
+		if (i + 1) * n // total > i * n // total:
+			yield rec
+
+def reservoir_sample(recs, n, rng):
+	"Return a uniform random sample of 'n' of the records 'recs', in their original order"
+	reservoir = []
+	for i, rec in enumerate(recs):
+		if i < n:
+			reservoir.append((i, rec))
+		else:
+			j = rng.randint(0, i)
+			if j < n:
+				reservoir[j] = (i, rec)
+	reservoir.sort()
+	return [rec for i, rec in reservoir]
+
+def subsample(path, out, n, method="stride", total=None, seed=0):
+	"Write 'n' reads of the metagenome 'path' to the file object 'out', taken by 'method': every (total / n)-th read (stride), or a uniform random sample (reservoir). 'total' is the number of reads in 'path', which is counted if it is not given. Returns the number of reads written"
+	if method == "stride":
+		if total is None:
+			total = sum(1 for rec in records(path))
+		sample = stride_sample(records(path), total, min(n, total))
+	elif method == "reservoir":
+		sample = reservoir_sample(records(path), n, random.Random(seed))
+	else:
+		raise Exception("Unknown sampling method: %s" % method)
+
+	written = 0
+	for rec in sample:
+		out.write(rec)
+		written += 1
+	return written
+
+
+def main():
+	parser = OptionParser(usage="%prog [options] METAGENOME OUTPUT",
+		description="Write a sample of the reads of METAGENOME to OUTPUT. OUTPUT is gzip-compressed if it ends with .gz.")
+	parser.add_option("-n", "--reads", dest="reads", type="int", default=None,
+		help="Number of reads to sample")
+	parser.add_option("-p", "--percent", dest="percent", type="float", default=None,
+		help="Percentage of the reads to sample")
+	parser.add_option("-m", "--method", dest="method", default="stride", choices=METHODS,
+		help="stride or reservoir (default: stride)")
+	parser.add_option("--seed", dest="seed", type="int", default=0,
+		help="Random seed for reservoir sampling (default: 0)")
+	options, args = parser.parse_args()
+
+	if len(args) != 2:
+		parser.error("METAGENOME and OUTPUT are required")
+	if (options.reads is None) == (options.percent is None):
+		parser.error("Either --reads or --percent is required")
+
+	path = args[0]
+	if not os.path.isfile(path):
+		raise Exception("No such file: %s" % path)
+	total = None
+	n = options.reads
+	if options.percent is not None:
+		total = sum(1 for rec in records(path))
+		n = max(1, int(round(total * options.percent / 100.0)))
+
+	if args[1].endswith(".gz"):
+		out = gzip.open(args[1], "wb")
+	else:
+		out = open(args[1], "wb")
+	try:
+		written = subsample(path, out, n, options.method, total, options.seed)
+	finally:
+		out.close()
+	print("%s: %d reads" % (args[1], written))
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+import sys
+import os
+import sqlite3
+
+# The tables of a summary store, one for each summary type of daxgen.SUMMARIES:
+# summary type, table, columns in the order of the tab-separated fields of the
+# summary file, and the indexed column. The last column takes the rest of the
+# fields, if a summary has more of them. Every table also has a sample column,
+# which refers to the samples table
+STATS = [("abundance", "INTEGER"), ("exp_avg", "REAL"), ("exp_stdv", "REAL"), ("ident_avg", "REAL"),
+	("ident_stdv", "REAL"), ("len_avg", "REAL"), ("len_stdv", "REAL")]
+TABLES = [
+	("md5", "md5s", [("md5", "TEXT")] + STATS + [("seek", "INTEGER"), ("length", "INTEGER")], "md5"),
+	("function", "functions", [("source", "TEXT"), ("function", "TEXT")] + STATS + [("md5s", "TEXT")], "function"),
+	("organism", "organisms", [("source", "TEXT"), ("organism", "TEXT")] + STATS + [("md5s", "TEXT")], "organism"),
+	("ontology", "ontologies", [("source", "TEXT"), ("ontology", "TEXT")] + STATS + [("md5s", "TEXT")], "ontology"),
+	("lca", "lcas", [("lca", "TEXT")] + STATS + [("md5s", "TEXT"), ("level", "INTEGER")], "lca"),
+	("source", "source_stats", [("source", "TEXT"), ("type", "TEXT"), ("counts", "TEXT")], "source")
+]
+
+# Rows are inserted in batches of this many
+BATCH_SIZE = 10000
+
+
+def connect(path):
+	"Create the store 'path' with empty tables, and return the connection. Stores are written once, so the journal is turned off"
+	if os.path.exists(path):
+		os.remove(path)
+	db = sqlite3.connect(path)
+	db.text_factory = str
+	db.execute("PRAGMA journal_mode = OFF")
+	db.execute("PRAGMA synchronous = OFF")
+	db.execute("CREATE TABLE samples (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL)")
+	for summaryType, table, columns, key in TABLES:
+		db.execute("CREATE TABLE %s (sample INTEGER NOT NULL REFERENCES samples (id), %s)" % (table,
+			", ".join("%s %s" % column for column in columns)))
+	return db
+
+def create_indexes(db):
+	"Index every table on its key. Indexes are built after the rows are loaded, which is much faster than keeping them up to date"
+	for summaryType, table, columns, key in TABLES:
+		db.execute("CREATE INDEX %s_%s ON %s (%s, sample)" % (table, key, table, key))
+	db.execute("ANALYZE")
+
+def summary_rows(sample, path, columns):
+	"Yield the rows of the summary file 'path' for the table with 'columns'"
+	f = open(path, "r")
+	try:
+		for line in f:
+			line = line.rstrip("\r\n")
+			if line == "" or line.startswith("#"):
+				continue
+			fields = line.split("\t", len(columns) - 1)
+			fields += [None] * (len(columns) - len(fields))
+			yield [sample] + [field if field != "" else None for field in fields]
+	finally:
+		f.close()
+
+def insert(db, table, columns, rows):
+	"Insert 'rows' into 'table' in batches. Returns the number of rows"
+	sql = "INSERT INTO %s VALUES (%s)" % (table, ", ".join(["?"] * (len(columns) + 1)))
+	count = 0
+	batch = []
+	for row in rows:
+		batch.append(row)
+		if len(batch) == BATCH_SIZE:
+			db.executemany(sql, batch)
+			count += len(batch)
+			batch = []
+	db.executemany(sql, batch)
+	return count + len(batch)
+
+
+def load(path, sample, summaries):
+	"Write the store 'path' with the summaries of one sample. 'summaries' maps summary types to files; types without a file are left empty"
+	unknown = set(summaries) - set(t[0] for t in TABLES)
+	if unknown:
+		raise Exception("Unknown summary types: %s" % ", ".join(sorted(unknown)))
+
+	tmp = "%s.tmp.%d" % (path, os.getpid())
+	db = connect(tmp)
+	try:
+		cursor = db.execute("INSERT INTO samples (name) VALUES (?)", (sample,))
+		sampleId = cursor.lastrowid
+		for summaryType, table, columns, key in TABLES:
+			if summaryType in summaries:
+				count = insert(db, table, columns, summary_rows(sampleId, summaries[summaryType], columns))
+				print("%s: %d rows" % (summaries[summaryType], count))
+		create_indexes(db)
+		db.commit()
+	except:
+		db.close()
+		os.remove(tmp)
+		raise
+	db.close()
+	os.rename(tmp, path)
+
+def merge(path, stores):
+	"Write the store 'path' with the samples of all of 'stores'. Sample names must be unique across the stores. Returns the number of samples"
+	tmp = "%s.tmp.%d" % (path, os.getpid())
+	db = connect(tmp)
+	samples = 0
+	try:
+		for store in stores:
+			if not os.path.isfile(store):
+				raise Exception("No such file: %s" % store)
+			db.execute("ATTACH DATABASE ? AS store", (store,))
+			for oldId, name in db.execute("SELECT id, name FROM store.samples ORDER BY id").fetchall():
+				try:
+					sampleId = db.execute("INSERT INTO samples (name) VALUES (?)", (name,)).lastrowid
+				except sqlite3.IntegrityError:
+					raise Exception("Sample %s of %s is already in the store" % (name, store))
+				samples += 1
+				for summaryType, table, columns, key in TABLES:
+					names = ", ".join(column for column, sqltype in columns)
+					db.execute("INSERT INTO %s SELECT ?, %s FROM store.%s WHERE sample = ?" % (table, names, table),
+						(sampleId, oldId))
+			db.commit()
+			db.execute("DETACH DATABASE store")
+		create_indexes(db)
+		db.commit()
+	except:
+		db.close()
+		os.remove(tmp)
+		raise
+	db.close()
+	os.rename(tmp, path)
+	return samples
+
+
+def main():
+	if len(sys.argv) >= 4 and sys.argv[1] == "load":
+		summaries = {}
+		for arg in sys.argv[4:]:
+			summaryType, summary = arg.split("=", 1)
+			if not os.path.isfile(summary):
+				raise Exception("No such file: %s" % summary)
+			summaries[summaryType] = summary
+		load(sys.argv[2], sys.argv[3], summaries)
+	elif len(sys.argv) >= 4 and sys.argv[1] == "merge":
+		samples = merge(sys.argv[2], sys.argv[3:])
+		print("%s: %d samples" % (sys.argv[2], samples))
+	else:
+		raise Exception("Usage: %s load STORE SAMPLE TYPE=SUMMARY... | merge STORE STORE..." % sys.argv[0])
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+import sys
+import os
+import re
+import json
+import time
+import errno
+import signal
+import socket
+import subprocess
+from xml.etree import ElementTree
+
+from resources import strip_namespace
+
+# The collector prints its record on one line of the job's standard output, after
+# this marker. Kickstart keeps the standard output in the job's .out file in the
+# submit directory, where the report finds it
+RECORD_MARKER = "@@telemetry "
+
+# Kickstart files (<jobname>.out.NNN) and the logs of runlocal.py (<jobname>.out)
+LOG_FILE = re.compile(r"\.out(\.\d+)?$")
+
+# Counters of /proc/self/io. rchar and wchar count all bytes passed to read and
+# write calls, read_bytes and write_bytes only those that reached the block device
+IO_COUNTERS = ["rchar", "wchar", "read_bytes", "write_bytes"]
+
+# The report lists this many jobs with the most I/O
+TOP_JOBS = 10
+
+GB = 1024.0 ** 3
+
+
+def read_io():
+	"Return the I/O counters of this process and of the children it has waited for. Empty where /proc/self/io is not available"
+	counters = {}
+	try:
+		f = open("/proc/self/io", "r")
+	except IOError:
+		return counters
+	try:
+		for line in f:
+			key, value = line.split(":", 1)
+			if key in IO_COUNTERS:
+				counters[key] = int(value)
+	finally:
+		f.close()
+	return counters
+
+def file_sizes(names):
+	"Return the sizes of the files 'names' that exist. A compressed file that is not there yet is measured under its plain name"
+	sizes = {}
+	for name in names:
+		for path in (name, re.sub(r"\.(gz|zst)$", "", name)):
+			if os.path.isfile(path):
+				sizes[name] = os.path.getsize(path)
+				break
+	return sizes
+
+def run(stage, command):
+	"Run 'command' as the stage 'stage' and print its telemetry record. The files in TELEMETRY_INPUTS and TELEMETRY_OUTPUTS are measured before and after it. Returns the exit status of the command"
+	inputs = file_sizes(os.environ.get("TELEMETRY_INPUTS", "").split())
+	env = dict(os.environ)
+	env["TELEMETRY_STAGE"] = stage
+
+	before = read_io()
+	start = time.time()
+	proc = subprocess.Popen(command, env=env)
+
+	# Signals from the batch system are passed on, so the command can clean up
+	def forward(signum, frame):
+		try:
+			os.kill(proc.pid, signum)
+		except OSError:
+			pass
+	for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+		signal.signal(signum, forward)
+
+	# The usage of the command includes every process below it that was waited for
+	while True:
+		try:
+			pid, status, usage = os.wait4(proc.pid, 0)
+			break
+		except OSError as e:
+			if e.errno != errno.EINTR:
+				raise
+	end = time.time()
+	after = read_io()
+
+	if os.WIFSIGNALED(status):
+		status = 128 + os.WTERMSIG(status)
+	else:
+		status = os.WEXITSTATUS(status)
+	proc.returncode = status
+
+	record = {
+		"job": os.environ.get("TELEMETRY_JOB"),
+		"stage": stage,
+		"host": socket.gethostname(),
+		"start": start,
+		"walltime": end - start,
+		"utime": usage.ru_utime,
+		"stime": usage.ru_stime,
+		"maxrss": usage.ru_maxrss,
+		"status": status,
+		"inputs": inputs,
+		"outputs": file_sizes(os.environ.get("TELEMETRY_OUTPUTS", "").split())
+	}
+	for key in IO_COUNTERS:
+		if key in before and key in after:
+			record[key] = after[key] - before[key]
+
+	sys.stdout.flush()
+	sys.stdout.write(RECORD_MARKER + json.dumps(record, sort_keys=True) + "\n")
+	sys.stdout.flush()
+	return status
+
+
+def read_records(path):
+	"Yield the telemetry records in the job log 'path', either a kickstart file or plain output"
+	f = open(path, "r")
+	try:
+		data = f.read()
+	finally:
+		f.close()
+
+	texts = [data]
+	if data.lstrip().startswith("<?xml"):
+		# Retried and clustered jobs append several invocation records to one file
+		texts = []
+		for doc in data.split("<?xml")[1:]:
+			try:
+				root = ElementTree.fromstring("<?xml" + doc)
+			except ElementTree.ParseError:
+				continue
+			for e in root.iter():
+				if strip_namespace(e.tag) == "statcall" and e.get("id") == "stdout":
+					for d in e:
+						if strip_namespace(d.tag) == "data":
+							texts.append(d.text or "")
+
+	for text in texts:
+		for line in text.splitlines():
+			if line.startswith(RECORD_MARKER):
+				try:
+					yield json.loads(line[len(RECORD_MARKER):])
+				except ValueError:
+					continue
+
+def read_workflow(wfdir):
+	"Return the telemetry records of a workflow directory, one per job, with the stage and resources of the job from jobs.json and the number of failed attempts in 'failures'"
+	path = os.path.join(wfdir, "jobs.json")
+	if not os.path.isfile(path):
+		raise Exception("No such file: %s" % path)
+	f = open(path, "r")
+	try:
+		jobs = json.load(f)
+	finally:
+		f.close()
+
+	records = {}
+	failures = {}
+	for dirpath, dirnames, filenames in os.walk(wfdir):
+		for filename in sorted(filenames):
+			if LOG_FILE.search(filename) is None:
+				continue
+			for record in read_records(os.path.join(dirpath, filename)):
+				jid = record.get("job")
+				if jid not in jobs:
+					continue
+				if record["status"] != 0:
+					failures[jid] = failures.get(jid, 0) + 1
+				# The last successful attempt is kept, or the last attempt if none succeeded
+				last = records.get(jid)
+				if last is None or (record["status"] == 0, record["start"]) >= (last["status"] == 0, last["start"]):
+					records[jid] = record
+
+	result = []
+	for jid in sorted(records):
+		record = dict(records[jid])
+		record["workflow"] = wfdir
+		record["stage"] = jobs[jid]["stage"]
+		record["failures"] = failures.get(jid, 0)
+		for key in ("walltime", "count"):
+			record["requested_" + key] = jobs[jid].get(key)
+		result.append(record)
+	return result
+
+
+def summarize(records):
+	"Aggregate 'records' by stage. Core efficiency is CPU time over wall time times the cores requested (1 when none are). Walltime use is the largest fraction of the requested walltime a job took"
+	stages = {}
+	for r in records:
+		s = stages.setdefault(r["stage"], {"jobs": 0, "failures": 0, "walltime": 0.0, "max_walltime": 0.0,
+			"cputime": 0.0, "core_seconds": 0.0, "walltime_use": 0.0, "maxrss": 0,
+			"read": 0, "written": 0, "input_size": 0, "output_size": 0})
+		cores = r.get("requested_count") or 1
+		s["jobs"] += 1
+		s["failures"] += r.get("failures", 0)
+		s["walltime"] += r["walltime"]
+		s["max_walltime"] = max(s["max_walltime"], r["walltime"])
+		s["cputime"] += r["utime"] + r["stime"]
+		s["core_seconds"] += r["walltime"] * cores
+		if r.get("requested_walltime"):
+			s["walltime_use"] = max(s["walltime_use"], r["walltime"] / (r["requested_walltime"] * 60.0))
+		s["maxrss"] = max(s["maxrss"], r["maxrss"])
+		s["read"] += r.get("rchar", 0)
+		s["written"] += r.get("wchar", 0)
+		s["input_size"] += sum(r["inputs"].values())
+		s["output_size"] += sum(r["outputs"].values())
+	for s in stages.values():
+		s["core_efficiency"] = s["cputime"] / s["core_seconds"] if s["core_seconds"] else 0.0
+		del s["core_seconds"]
+	return stages
+
+def top_io(records, n=TOP_JOBS):
+	"Return the 'n' records with the most bytes read and written"
+	return sorted(records, key=lambda r: r.get("rchar", 0) + r.get("wchar", 0), reverse=True)[:n]
+
+def print_report(title, records):
+	print(title)
+	if len(records) == 0:
+		print("  No telemetry records")
+		return
+
+	# Stages that took the most wall time come first, as they are the ones worth optimizing
+	stages = summarize(records)
+	print("  %-28s %5s %9s %9s %8s %7s %7s %8s %9s %9s" % ("Stage", "Jobs", "Wall(min)", "Max(min)",
+		"CPU(h)", "CoreEff", "WallUse", "RSS(GB)", "Read(GB)", "Write(GB)"))
+	for stage in sorted(stages, key=lambda name: -stages[name]["walltime"]):
+		s = stages[stage]
+		print("  %-28s %5d %9.1f %9.1f %8.2f %6.0f%% %6.0f%% %8.2f %9.2f %9.2f" % (stage, s["jobs"],
+			s["walltime"] / 60.0, s["max_walltime"] / 60.0, s["cputime"] / 3600.0, 100 * s["core_efficiency"],
+			100 * s["walltime_use"], s["maxrss"] / (1024.0 * 1024.0), s["read"] / GB, s["written"] / GB))
+	failures = sum(s["failures"] for s in stages.values())
+	if failures:
+		print("  %d failed attempts" % failures)
+
+	print("  Top I/O consumers:")
+	for r in top_io(records):
+		job = "%s:%s" % (os.path.basename(os.path.normpath(r["workflow"])), r["job"])
+		print("    %-24s %-28s read %8.2f GB  written %8.2f GB  inputs %8.2f GB  outputs %8.2f GB" % (job,
+			r["stage"], r.get("rchar", 0) / GB, r.get("wchar", 0) / GB, sum(r["inputs"].values()) / GB,
+			sum(r["outputs"].values()) / GB))
+
+
+def main():
+	if len(sys.argv) >= 4 and sys.argv[1] == "run":
+		sys.exit(run(sys.argv[2], sys.argv[3:]))
+	elif len(sys.argv) >= 3 and sys.argv[1] == "report":
+		records = []
+		for wfdir in sys.argv[2:]:
+			if not os.path.isdir(wfdir):
+				raise Exception("No such directory: %s" % wfdir)
+			wfrecords = read_workflow(wfdir)
+			print_report("Workflow %s" % wfdir, wfrecords)
+			records += wfrecords
+		if len(sys.argv) > 3:
+			print_report("All %d workflows" % (len(sys.argv) - 2), records)
+	else:
+		raise Exception("Usage: %s run STAGE COMMAND... | report WORKFLOW_DIR..." % sys.argv[0])
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import StageCache
+
+
+class StageCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.data = os.path.join(self.tmp, "data")
+		f = open(self.data, "w")
+		f.write("x" * 100)
+		f.close()
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def test_evict(self):
+		"The least recently used entries are evicted once the cache is full"
+		cache = StageCache(os.path.join(self.tmp, "cache"), 250)
+		for key in ["a", "b", "c"]:
+			cache.store(key, {"data": self.data})
+		self.assertEqual(cache.lookup("a"), None)
+		self.assertNotEqual(cache.lookup("b"), None)
+		self.assertNotEqual(cache.lookup("c"), None)
+
+	def test_lease(self):
+		"An entry that was looked up is not evicted by the stores of the workflow it was registered for"
+		path = os.path.join(self.tmp, "cache")
+		StageCache(path, 250).store("a", {"data": self.data})
+		cache = StageCache(path, 250, 3600)
+		self.assertNotEqual(cache.lookup("a"), None)
+		for key in ["b", "c", "d"]:
+			cache.store(key, {"data": self.data})
+		self.assertNotEqual(cache.lookup("a"), None)
+		self.assertEqual(cache.lookup("b"), None)
+		self.assertEqual(cache.lookup("c"), None)
+		self.assertNotEqual(cache.lookup("d"), None)
+
+
+if __name__ == '__main__':
+	unittest.main()
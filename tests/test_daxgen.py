@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+import sys
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from ConfigParser import ConfigParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from daxgen import MGRASTWorkflow, scale_resources, PREVIEW_WALLTIME
+from resources import Resources
+
+
+class ScaleResourcesTest(unittest.TestCase):
+
+	def test_long_stage(self):
+		"A long stage shrinks with the sample, and gets fewer cores once it is held at PREVIEW_WALLTIME"
+		self.assertEqual(scale_resources(Resources(600, 8, None), 0.1), Resources(60, 8, None))
+		self.assertEqual(scale_resources(Resources(600, 8, None), 0.01), Resources(PREVIEW_WALLTIME, 3, None))
+
+	def test_short_stage(self):
+		"A stage shorter than PREVIEW_WALLTIME never asks for more than its full walltime or fewer of its cores"
+		self.assertEqual(scale_resources(Resources(10, 4, None), 0.01), Resources(10, 4, None))
+		self.assertEqual(scale_resources(Resources(10, None, None), 0.5), Resources(10, None, None))
+		self.assertEqual(scale_resources(Resources(PREVIEW_WALLTIME, 8, None), 0.01), Resources(PREVIEW_WALLTIME, 8, None))
+
+
+class SummaryStoreTest(unittest.TestCase):
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.config = ConfigParser()
+		self.config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mgrast.cfg"))
+		self.config.set("simulation", "chunk_size", "1")
+		self.config.set("simulation", "summary_db", "1")
+		self.config.add_section("sweep")
+		self.config.set("sweep", "aa_pid", "80 90")
+
+	def tearDown(self):
+		shutil.rmtree(self.tmp)
+
+	def write_reads(self, name, size):
+		"Write random reads of about 'size' bytes to the file 'name' in the temporary directory"
+		path = os.path.join(self.tmp, name)
+		rng = random.Random(name)
+		f = open(path, "w")
+		written = 0
+		while written < size:
+			record = ">r%d\n%s\n" % (written, "".join(rng.choice("ACGT") for i in range(150)))
+			f.write(record)
+			written += len(record)
+		f.close()
+		return path
+
+	def summary_stores(self, samples):
+		"Generate the workflow for 'samples' and return the store and sample arguments of its store jobs"
+		workflow = MGRASTWorkflow(os.path.join(self.tmp, "wf"), self.config, samples)
+		os.makedirs(workflow.outdir)
+		workflow.generate_workflow()
+		self.assertTrue(all(workflow.read_chunks(mgfile) > 1 for name, mgfile in samples))
+		return [job.arguments[:2] for job, store, size in workflow.summary_stores]
+
+	def test_chunked_batch(self):
+		"Every store of a chunked batch sweep is named after its sample and variant"
+		samples = [("a", self.write_reads("a.fna", 1536 * 1024)), ("b", self.write_reads("b.fna", 1536 * 1024))]
+		self.assertEqual(self.summary_stores(samples), [
+			["a.aa_pid_80.700.annotation.db", "a.aa_pid_80"],
+			["a.aa_pid_90.700.annotation.db", "a.aa_pid_90"],
+			["b.aa_pid_80.700.annotation.db", "b.aa_pid_80"],
+			["b.aa_pid_90.700.annotation.db", "b.aa_pid_90"]])
+
+	def test_chunked_single(self):
+		"The stores of a chunked single-metagenome sweep are named after the metagenome file"
+		samples = [(None, self.write_reads("c.fna", 1536 * 1024))]
+		self.assertEqual(self.summary_stores(samples), [
+			["aa_pid_80.700.annotation.db", "c.aa_pid_80"],
+			["aa_pid_90.700.annotation.db", "c.aa_pid_90"]])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+import sys
+import os
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stagegraph import StageGraph
+
+
+class Job(object):
+
+	def __init__(self, name):
+		self.name = name
+
+
+def pipeline(graph, sample):
+	"Add a pipeline shaped like a sample of the workflow: a chain with two branches and a fan-out of chunks, where every job also depends on the parents of its parents. Returns the jobs by name"
+	jobs = dict((name, Job("%s.%s" % (sample, name))) for name in ["qc", "preprocess", "split", "chunk1", "chunk2", "merge", "rna", "summary"])
+	edges = [("qc", "preprocess"), ("preprocess", "split"), ("split", "chunk1"), ("split", "chunk2"), ("chunk1", "merge"),
+		("chunk2", "merge"), ("preprocess", "rna"), ("merge", "summary"), ("rna", "summary"), ("qc", "summary")]
+	for name in jobs:
+		graph.add_job(jobs[name], 10)
+	for parent, child in edges:
+		graph.add_edge(jobs[parent], jobs[child])
+		for grandparent, other in edges:
+			if other == parent:
+				graph.add_edge(jobs[grandparent], jobs[child])
+	return jobs
+
+
+class StageGraphTest(unittest.TestCase):
+
+	def test_reduced_edges(self):
+		"Edges implied by longer paths are dropped"
+		graph = StageGraph()
+		jobs = pipeline(graph, "s")
+		edges = set((parent.name, child.name) for parent, child in graph.reduced_edges())
+		for grandparent, child in [("qc", "split"), ("qc", "rna"), ("qc", "summary"), ("preprocess", "chunk1"), ("split", "merge"), ("chunk2", "summary")]:
+			self.assertTrue((jobs[grandparent], jobs[child]) in graph.edges())
+			self.assertFalse((jobs[grandparent].name, jobs[child].name) in edges)
+		self.assertEqual(edges, set([("s.qc", "s.preprocess"), ("s.preprocess", "s.split"), ("s.split", "s.chunk1"),
+			("s.split", "s.chunk2"), ("s.chunk1", "s.merge"), ("s.chunk2", "s.merge"), ("s.preprocess", "s.rna"),
+			("s.merge", "s.summary"), ("s.rna", "s.summary")]))
+
+	def test_convex_groups(self):
+		"A job does not join a group that reaches it through a job outside of the group"
+		graph = StageGraph()
+		jobs = pipeline(graph, "s")
+		short = [jobs[name] for name in ["qc", "preprocess", "rna", "summary"]]
+		groups = [sorted(job.name for job in group) for group in graph.convex_groups(short)]
+		self.assertEqual(groups, [["s.preprocess", "s.qc", "s.rna"]])
+
+	def test_batch(self):
+		"Reduction and grouping stay fast on a large batch joined by one job"
+		graph = StageGraph()
+		join = Job("join")
+		short = [join]
+		for i in range(5000):
+			jobs = pipeline(graph, "s%d" % i)
+			graph.add_edge(jobs["summary"], join)
+			short += [jobs["qc"], jobs["preprocess"], jobs["summary"]]
+		start = time.time()
+		self.assertEqual(len(graph.reduced_edges()), 5000 * 10)
+		# The qc and preprocess jobs of every sample, and the join with the first summary
+		self.assertEqual(len(graph.convex_groups(short)), 5000 + 1)
+		self.assertTrue(time.time() - start < 60)
+
+
+if __name__ == '__main__':
+	unittest.main()